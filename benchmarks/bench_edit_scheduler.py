@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Run uploads against the fake Wikibase API
+
+Starts benchmarks/fake_api.py with a rate limit, a lag spike and a short
+outage and uploads foreign ids to fake lexemes with the BatchUploader as
+fast as models/edit_scheduler.py allows. The edits are made by
+Lexeme.upload_foreign_id_to_wikidata() like in a real run so the whole
+path from the response to the scheduler is exercised. Every other lexeme
+is submitted without its entity, like when the pre-flight check is off,
+so it is fetched during the edit too. Prints the accepted
+edits per second so the throughput can be seen to recover after
+throttling instead of oscillating, and exits with an error if any upload
+failed.
+
+Run from the root of the repository:
+$ python3 -m benchmarks.bench_edit_scheduler --seconds 20
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+
+from wikibaseintegrator import wbi_config, wbi_core
+
+import config
+from benchmarks.fake_api import FakeAPIServer, FakeLogin
+from models.edit_scheduler import EditScheduler
+from models.uploader import BatchUploader
+from models.wikidata import ForeignID, Lexeme
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--server-edits-per-minute", type=float, default=600)
+    parser.add_argument("--edits-per-minute", type=float, default=900,
+                        help="the ceiling of the scheduler, above what the server allows")
+    parser.add_argument("--maxlag", type=float, default=5)
+    args = parser.parse_args()
+    # Lagged for two seconds a third into the run and down for a
+    # second two thirds into it
+    spike = args.seconds / 3
+    outage = args.seconds * 2 / 3
+    server = FakeAPIServer(edits_per_minute=args.server_edits_per_minute,
+                           lag_schedule=[(spike, spike + 2, args.maxlag * 2)],
+                           outage_schedule=[(outage, outage + 1)])
+    server.start()
+    wbi_config.config["MEDIAWIKI_API_URL"] = server.url()
+    # WBI looks these up on WDQS the first time otherwise
+    wbi_core.ItemEngine.distinct_value_props[wbi_config.config["SPARQL_ENDPOINT_URL"]] = set()
+    config.login_instance = FakeLogin()
+    config.maxlag = args.maxlag
+    uploader = BatchUploader(workers=args.workers, edits_per_minute=args.edits_per_minute)
+    uploader.scheduler = EditScheduler(edits_per_minute=args.edits_per_minute,
+                                       min_edits_per_minute=args.edits_per_minute / 20,
+                                       max_retries=100, base_delay=0.5, max_delay=5)
+    foreign_id = ForeignID(id="1", property="P8478", source_item_id="Q1935308")
+    started = time.monotonic()
+    deadline = started + args.seconds
+    number = 0
+    # The uploads print every edit
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        with uploader:
+            while time.monotonic() < deadline:
+                number += 1
+                lexeme = Lexeme(id=f"L{number}", lemma="test", lexical_category="Q1084")
+                entity = None
+                if number % 2 == 0:
+                    entity = {"id": lexeme.id, "type": "lexeme", "lastrevid": 1, "claims": {}}
+                uploader.submit(lexeme=lexeme, foreign_id=foreign_id, entity=entity)
+    elapsed = time.monotonic() - started
+    server.shutdown()
+    per_second = Counter(int(second) for second in server.accepted)
+    for second in range(int(elapsed) + 1):
+        print(f"{second:3d}s {per_second[second]:4d} {'#' * per_second[second]}")
+    print(f"Accepted {len(server.accepted)} edits, "
+          f"{round(len(server.accepted) / elapsed * 60)} per minute "
+          f"of the {args.server_edits_per_minute} allowed. "
+          f"{server.maxlag_errors} maxlag errors, {server.unavailable} unavailable "
+          f"and {server.rate_limited} rate limited.")
+    print(uploader.report())
+    if uploader.failures:
+        sys.exit(f"{len(uploader.failures)} uploads failed")
+
+
+if __name__ == "__main__":
+    main()
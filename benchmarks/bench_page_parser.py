@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Compare the BeautifulSoup parser in get_saob_list.py with the
+streaming extractor in models/saob_list_page.py
+
+Pages are read from benchmarks/pages/*.html. Save some real pages there
+first with --fetch or the benchmark falls back to generated pages. The
+parsers are checked to give the same rows on every page and on generated
+pages with nested spans before they are timed.
+
+Run from the root of the repository:
+$ python3 -m benchmarks.bench_page_parser --fetch 20
+$ python3 -m benchmarks.bench_page_parser
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+from typing import List
+
+import get_saob_list
+from benchmarks.synthetic import generate_page
+from models import saob_list_page
+from models.http_client import shared_client
+
+pages_dir = os.path.join(os.path.dirname(__file__), "pages")
+
+
+class Response:
+    """The parts of requests.Response that the parsers use"""
+    def __init__(self, content: bytes):
+        self.content = content
+        self.text = content.decode("utf-8")
+
+
+def fetch_pages(count: int):
+    """Save count real pages from the start of the list"""
+    os.makedirs(pages_dir, exist_ok=True)
+    unik = '0'
+    for number in range(count):
+        response = shared_client().post(
+            get_saob_list.url,
+            data={'action': 'myprefix_scrollist', 'unik': unik, 'dir': 'ned', 'dict': 'saob'},
+            headers=get_saob_list.headers
+        )
+        with open(os.path.join(pages_dir, f"{number:04d}.html"), "wb") as file:
+            file.write(response.content)
+        rows, unik = saob_list_page.extract_rows(response.content)
+        if unik == -1:
+            break
+    print(f"Saved {number + 1} pages to {pages_dir}")
+
+
+def load_pages() -> List[bytes]:
+    paths = sorted(glob.glob(os.path.join(pages_dir, "*.html")))
+    if paths:
+        print(f"Using {len(paths)} saved pages from {pages_dir}")
+        pages = []
+        for path in paths:
+            with open(path, "rb") as file:
+                pages.append(file.read())
+        return pages
+    print("No saved pages found, using 20 generated pages")
+    return [generate_page(start=number * 50) for number in range(20)]
+
+
+def measure(name: str, parse, pages: List[bytes], rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            parse(page)
+    seconds = time.perf_counter() - start
+    # Measure memory separately because tracing slows everything down
+    tracemalloc.start()
+    for page in pages:
+        parse(page)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pages_per_second = rounds * len(pages) / seconds
+    print(f"{name}: {round(pages_per_second)} pages/s, "
+          f"peak {round(peak / 1024)} KiB allocated")
+    return pages_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fetch", type=int, metavar="PAGES",
+                        help="save this many real pages and exit")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    if args.fetch:
+        fetch_pages(args.fetch)
+        return
+    pages = load_pages()
+    # Both parsers have to agree before we compare their speed
+    nested_pages = [generate_page(start=number * 50, nested_every=7) for number in range(2)]
+    for page in pages + nested_pages:
+        expected = get_saob_list.parse_response(Response(page))
+        if saob_list_page.extract_rows(page) != expected:
+            raise Exception("The parsers disagree, see the page:\n" + page.decode("utf-8")[:500])
+    slow = measure("BeautifulSoup", lambda page: get_saob_list.parse_response(Response(page)),
+                   pages, args.rounds)
+    fast = measure("saob_list_page", saob_list_page.extract_rows, pages, args.rounds)
+    print(f"The streaming extractor is {round(fast / slow, 1)} times faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""A local fake of the Wikibase API for testing uploads without Wikidata
+
+It accepts wbeditentity like Wikidata does with a rate limit and
+schedules of replication lag and outages:
+- while the lag is above the maxlag parameter it returns a maxlag error
+  with Retry-After like MediaWiki
+- during an outage it returns 503 with Retry-After
+- above edits_per_minute it returns 429 with Retry-After
+- edits without a token get a badtoken error
+wbgetentities returns an empty lexeme for every id, with the same lag
+and outages, so the pre-flight check and the fetches made for edits can
+be run against it too. Log in with FakeLogin to edit through
+models/wikidata.py.
+
+Run from the root of the repository:
+$ python3 -m benchmarks.fake_api --port 8080 --edits-per-minute 120
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    server: "FakeAPIServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data: dict, status: int = 200, headers: dict = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_api(dict(parse_qsl(urlparse(self.path).query)))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        parameters = dict(parse_qsl(urlparse(self.path).query))
+        parameters.update(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        self.handle_api(parameters)
+
+    def handle_api(self, parameters: dict):
+        action = parameters.get("action")
+        if action == "wbgetentities":
+            status, data, headers = self.server.read(parameters)
+            self.send_json(data, status, headers)
+        elif action == "wbeditentity":
+            status, data, headers = self.server.edit(parameters)
+            self.send_json(data, status, headers)
+        else:
+            self.send_json({"error": {"code": "badvalue", "info": f"Unknown action {action}"}})
+
+
+class FakeLogin:
+    """Used as config.login_instance instead of a wbi_login.Login,
+    the fake API takes any token"""
+    session: requests.Session
+
+    def __init__(self):
+        self.session = requests.Session()
+
+    def get_edit_token(self) -> str:
+        return "fake+\\"
+
+    def get_session(self) -> requests.Session:
+        return self.session
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """lag_schedule is a list of (start, end, lag) and outage_schedule
+    a list of (start, end) in seconds since the server was started"""
+    daemon_threads = True
+    edits_per_minute: float
+    lag_schedule: List[Tuple[float, float, float]]
+    outage_schedule: List[Tuple[float, float]]
+    retry_after: int
+    accepted: List[float]
+    maxlag_errors: int
+    unavailable: int
+    rate_limited: int
+
+    def __init__(self, port: int = 0, edits_per_minute: float = 120,
+                 lag_schedule: List[Tuple[float, float, float]] = (),
+                 outage_schedule: List[Tuple[float, float]] = (), retry_after: int = 1):
+        super().__init__(("127.0.0.1", port), FakeAPIHandler)
+        self.edits_per_minute = edits_per_minute
+        self.lag_schedule = list(lag_schedule)
+        self.outage_schedule = list(outage_schedule)
+        self.retry_after = retry_after
+        self.started = time.monotonic()
+        self.accepted = []
+        self.maxlag_errors = 0
+        self.unavailable = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+        # A token bucket with room for a burst of a second of edits
+        self.capacity = max(1.0, edits_per_minute / 60)
+        self.tokens = self.capacity
+        self.refilled = self.started
+
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/w/api.php"
+
+    def lag(self, now: float) -> float:
+        elapsed = now - self.started
+        for start, end, lag in self.lag_schedule:
+            if start <= elapsed < end:
+                return lag
+        return 0
+
+    def outage(self, now: float) -> bool:
+        elapsed = now - self.started
+        return any(start <= elapsed < end for start, end in self.outage_schedule)
+
+    def unavailable_response(self, parameters: dict, now: float):
+        """The response during an outage or while lagged, otherwise None.
+        Call with the lock held"""
+        lag = self.lag(now)
+        if self.outage(now):
+            self.unavailable += 1
+            return 503, {"error": {"code": "unavailable", "info": "Service Unavailable"}}, \
+                {"Retry-After": self.retry_after}
+        if "maxlag" in parameters and lag > float(parameters["maxlag"]):
+            self.maxlag_errors += 1
+            return 200, {"error": {"code": "maxlag", "lag": lag,
+                                   "info": f"Waiting for a database server: {lag} seconds lagged."}}, \
+                {"Retry-After": self.retry_after, "X-Database-Lag": lag}
+        return None
+
+    def read(self, parameters: dict):
+        with self.lock:
+            response = self.unavailable_response(parameters, time.monotonic())
+        if response is not None:
+            return response
+        return 200, {"entities": {
+            id: {"id": id, "type": "lexeme", "lastrevid": 1, "claims": {}}
+            for id in parameters.get("ids", "").split("|")
+        }}, {}
+
+    def edit(self, parameters: dict):
+        now = time.monotonic()
+        if "token" not in parameters:
+            return 200, {"error": {"code": "badtoken", "info": "Invalid CSRF token."}}, {}
+        with self.lock:
+            response = self.unavailable_response(parameters, now)
+            if response is not None:
+                return response
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.refilled) * self.edits_per_minute / 60)
+            self.refilled = now
+            if self.tokens < 1:
+                self.rate_limited += 1
+                return 429, {"error": {"code": "ratelimited",
+                                       "info": "You've exceeded your rate limit."}}, \
+                    {"Retry-After": self.retry_after}
+            self.tokens -= 1
+            self.accepted.append(now - self.started)
+        return 200, {"success": 1, "entity": {"id": parameters.get("id"), "lastrevid": 2}}, {}
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="fake-api", daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--edits-per-minute", type=float, default=120)
+    parser.add_argument("--lag", type=float, nargs=3, action="append", default=[],
+                        metavar=("START", "END", "LAG"),
+                        help="replication lag in seconds between START and END seconds")
+    parser.add_argument("--outage", type=float, nargs=2, action="append", default=[],
+                        metavar=("START", "END"),
+                        help="answer edits with 503 between START and END seconds")
+    args = parser.parse_args()
+    server = FakeAPIServer(port=args.port, edits_per_minute=args.edits_per_minute,
+                           lag_schedule=args.lag, outage_schedule=args.outage)
+    print(f"Serving a fake Wikibase API on {server.url()}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
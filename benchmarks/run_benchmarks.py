@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Benchmark the hot paths on synthetic data
+
+Times loading the SAOB list (CSV and snapshot), matching lexemes,
+check_matching_category and parsing list pages for every size given and
+ranking homographs. The plans of matching serially, in parallel, against
+the snapshot and by merge join are checked to be the same and the run
+fails if they are not.
+Network and uploads are stubbed out. The results are written as JSON to
+benchmarks/results/<commit>.json so runs of two commits can be compared.
+
+Run from the root of the repository:
+$ python3 -m benchmarks.run_benchmarks --rows 10000 100000 1000000
+$ python3 -m benchmarks.run_benchmarks --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import config
+import get_saob_list
+import lexsaob
+from benchmarks import synthetic
+from benchmarks.bench_page_parser import Response, load_pages
+from models import saob, saob_list_page
+from models.homograph_ranker import HomographRanker
+from models.plan import MatchPlanWriter
+from models.saob_snapshot import SAOBSnapshot
+
+results_dir = os.path.join(os.path.dirname(__file__), "results")
+
+
+class StubUploader:
+    """Accepts uploads without uploading anything"""
+    def __init__(self):
+        self.count = 0
+
+    def submit(self, lexeme=None, foreign_id=None):
+        self.count += 1
+
+
+def measure(function: Callable, items: int, memory: bool = True) -> Dict:
+    """Time function() and optionally run it again with tracemalloc
+    to find the peak memory"""
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    result = {
+        "seconds": round(seconds, 4),
+        "items": items,
+        "items_per_second": round(items / seconds) if seconds > 0 else None,
+    }
+    if memory:
+        # Tracing slows everything down so it is a separate run
+        tracemalloc.start()
+        function()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_kib"] = round(peak / 1024)
+    return result
+
+
+def check_plans(lexemes: List, saob_lemma_index: Dict[str, saob.SAOBLemmaGroup],
+                snapshot: SAOBSnapshot, directory: str):
+    """Raise if the ways of matching do not write the same plan"""
+    paths = {
+        "serial": dict(saob_lemma_index=saob_lemma_index, processes=1, merge=False),
+        "parallel": dict(saob_lemma_index=saob_lemma_index, processes=2, merge=False),
+        "snapshot": dict(saob_lemma_index=snapshot, processes=1, merge=False),
+        "parallel_snapshot": dict(saob_lemma_index=snapshot, processes=2, merge=False),
+        "merge_join": dict(saob_lemma_index=snapshot, merge=True),
+    }
+    plans = {}
+    for name, arguments in paths.items():
+        plan_path = os.path.join(directory, f"plan_{name}.jsonl")
+        with MatchPlanWriter(plan_path) as plan_writer:
+            lexsaob.process_lexemes(lexemes=lexemes, plan_writer=plan_writer, **arguments)
+        with open(plan_path, encoding="utf-8") as file:
+            plans[name] = file.readlines()
+    # The merge join writes the plan in lemma order
+    plans["merge_join"] = sorted(plans["merge_join"])
+    expected = sorted(plans["serial"])
+    for name, lines in plans.items():
+        if name != "merge_join" and lines != plans["serial"]:
+            raise Exception(f"The plan of {name} matching is not the same as the serial plan")
+        if sorted(lines) != expected:
+            raise Exception(f"The plan of {name} matching has other decisions than the serial plan")
+    print(f"  the plans of {', '.join(plans)} matching are the same")
+
+
+def benchmark_size(rows: int, lexemes_count: int, homograph_ratio: float,
+                   memory: bool, directory: str) -> Dict:
+    csv_path = os.path.join(directory, f"saob_{rows}.csv")
+    snapshot_path = os.path.join(directory, f"saob_{rows}.snapshot")
+    saob_lemmas = synthetic.write_saob_csv(csv_path, rows=rows, homograph_ratio=homograph_ratio)
+    lexemes = synthetic.generate_lexemes(saob_lemmas, count=lexemes_count)
+    stages = {}
+    print(f"Benchmarking {rows} SAOB rows and {lexemes_count} lexemes")
+    stages["load_csv"] = measure(lambda: saob.load_saob_into_memory(csv_path), rows, memory)
+    stages["build_snapshot"] = measure(
+        lambda: SAOBSnapshot.write_from_csv(csv_path, snapshot_path), rows, memory
+    )
+    stages["open_snapshot"] = measure(lambda: SAOBSnapshot(snapshot_path).close(), rows, memory)
+    saob_lemma_index = saob.load_saob_into_memory(csv_path)
+    stages["match_csv_index"] = measure(
+        lambda: lexsaob.process_lexemes(lexemes=lexemes, saob_lemma_index=saob_lemma_index,
+                                        uploader=StubUploader()),
+        lexemes_count, memory
+    )
+    with SAOBSnapshot(snapshot_path) as snapshot:
+        stages["match_snapshot"] = measure(
+            lambda: lexsaob.process_lexemes(lexemes=lexemes, saob_lemma_index=snapshot,
+                                            uploader=StubUploader()),
+            lexemes_count, memory
+        )
+        check_plans(lexemes, saob_lemma_index, snapshot, directory)
+    pairs = [(lexeme, entry)
+             for lexeme in lexemes
+             for entry in saob_lemma_index.get(lexeme.lemma, ())]
+
+    def check_all_pairs():
+        for lexeme, entry in pairs:
+            lexsaob.check_matching_category(lexeme=lexeme, saob_entry=entry)
+
+    stages["check_matching_category"] = measure(check_all_pairs, len(pairs), memory)
+    for stage, result in stages.items():
+        print(f"  {stage}: {result}")
+    return stages
+
+
+def benchmark_page_parsing(memory: bool, rounds: int = 5) -> Dict:
+    pages = load_pages() * rounds
+    stages = {
+        "parse_response": measure(
+            lambda: [get_saob_list.parse_response(Response(page)) for page in pages],
+            len(pages), memory
+        ),
+        "extract_rows": measure(
+            lambda: [saob_list_page.extract_rows(page) for page in pages],
+            len(pages), memory
+        ),
+    }
+    for stage, result in stages.items():
+        print(f"  {stage}: {result}")
+    return stages
+
+
+def benchmark_ranking(cases_count: int, memory: bool) -> Dict:
+    cases, articles = synthetic.generate_homograph_cases(count=cases_count)
+    stages = {
+        "rank_homographs": measure(lambda: HomographRanker().rank(cases, articles),
+                                   cases_count, memory),
+    }
+    chosen_count = sum(case.best() == case.candidates[0] for case in cases)
+    print(f"  chose the right entry for {chosen_count} of {cases_count} cases")
+    for stage, result in stages.items():
+        print(f"  {stage}: {result}")
+    return stages
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous_path: str, results: Dict):
+    with open(previous_path) as file:
+        previous = json.load(file)
+    print(f"Compared to {previous['commit']}:")
+    for size, stages in results["sizes"].items():
+        for stage, result in stages.items():
+            before = previous["sizes"].get(size, {}).get(stage)
+            if before is None:
+                continue
+            change = (result["seconds"] - before["seconds"]) / before["seconds"] * 100
+            print(f"  {size} {stage}: {before['seconds']}s -> {result['seconds']}s "
+                  f"({round(change):+d}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000],
+                        help="sizes of the generated SAOB lists")
+    parser.add_argument("--lexemes", type=int,
+                        help="number of lexemes (default a quarter of the rows)")
+    parser.add_argument("--homograph-ratio", type=float, default=0.2)
+    parser.add_argument("--homograph-cases", type=int, default=10000,
+                        help="number of lexemes with homographs to rank")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the slow tracemalloc runs")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="earlier results to compare with")
+    args = parser.parse_args()
+    # Matching logs every lexeme and we only want the timings
+    logging.disable(logging.INFO)
+    config.match_subentry = False
+    # Ranking needs glosses and articles, it is benchmarked on its own
+    config.rank_homographs = False
+    lexsaob.count_only = False
+    results = {
+        "commit": current_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "homograph_ratio": args.homograph_ratio,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            lexemes_count = args.lexemes or rows // 4
+            results["sizes"][str(rows)] = benchmark_size(
+                rows, lexemes_count, args.homograph_ratio, not args.no_memory, directory
+            )
+    print("Benchmarking list page parsing")
+    results["sizes"]["pages"] = benchmark_page_parsing(not args.no_memory)
+    print(f"Benchmarking ranking {args.homograph_cases} lexemes with homographs")
+    results["sizes"]["homographs"] = benchmark_ranking(args.homograph_cases, not args.no_memory)
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{results['commit']}.json")
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote the results to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Generate synthetic SAOB lists, lexemes and list pages for the benchmarks"""
+import random
+from csv import writer
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+from models.homograph_ranker import HomographCase
+from models.wikidata import Lexeme
+
+letters = "abcdefghijklmnopqrstuvxyzåäö"
+# Roughly how often the categories occur in SAOB
+saob_categories = (["subst."] * 50 + ["verb"] * 15 + ["adj."] * 15 + ["adv."] * 5 +
+                   ["(prep)", "ssgled", "interj.", "räkn.", "pron.", "konj.",
+                    "prefix", "suffix", ""])
+lexical_categories = ["Q1084"] * 6 + ["Q24905"] * 2 + ["Q34698"] * 2 + ["Q380057"]
+
+
+def random_lemma(rng: random.Random) -> str:
+    return "".join(rng.choice(letters) for _ in range(rng.randint(3, 12)))
+
+
+def write_saob_csv(path: str,
+                   rows: int = 10000,
+                   homograph_ratio: float = 0.2,
+                   seed: int = 1) -> List[str]:
+    """Write a SAOB list like the one from get_saob_list.py with
+    roughly homograph_ratio of the rows sharing their lemma with an
+    earlier row. Returns the distinct lemmas."""
+    rng = random.Random(seed)
+    lemmas = []
+    with open(path, "w", newline="") as file:
+        csv_writer = writer(file, lineterminator="\n")
+        for number in range(rows):
+            if lemmas and rng.random() < homograph_ratio:
+                lemma = rng.choice(lemmas)
+            else:
+                lemma = random_lemma(rng)
+                lemmas.append(lemma)
+            id = f"{lemma[0].upper()}_{number:07d}.{rng.randint(0, 9999):04d}"
+            csv_writer.writerow(["null",
+                                 lemma,
+                                 rng.choice(saob_categories),
+                                 rng.choice(["", "", "1", "2"]),
+                                 f"https://svenska.se/saob/?id={id}&pz=5"])
+    return lemmas
+
+
+def generate_lexemes(saob_lemmas: List[str],
+                     count: int = 10000,
+                     match_ratio: float = 0.7,
+                     seed: int = 2) -> List[Lexeme]:
+    """Lexemes of which roughly match_ratio have a lemma in SAOB"""
+    rng = random.Random(seed)
+    lexemes = []
+    for number in range(1, count + 1):
+        if rng.random() < match_ratio:
+            lemma = rng.choice(saob_lemmas)
+        else:
+            lemma = random_lemma(rng)
+        lexemes.append(Lexeme(id=f"L{number}",
+                              lemma=lemma,
+                              lexical_category=rng.choice(lexical_categories)))
+    return lexemes
+
+
+def generate_homograph_cases(count: int = 10000,
+                             candidates: int = 3,
+                             vocabulary_size: int = 50000,
+                             seed: int = 3) -> Tuple[List[HomographCase], Dict[str, str]]:
+    """Lexemes with candidates homographs each and the articles of the
+    homographs. Words are drawn with a Zipf like skew and the glosses
+    share words with the article of the first candidate."""
+    rng = random.Random(seed)
+    words = [random_lemma(rng) for _ in range(vocabulary_size)]
+    cumulative_weights = list(accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+
+    def text(length: int) -> List[str]:
+        return rng.choices(words, cum_weights=cumulative_weights, k=length)
+
+    cases = []
+    articles = {}
+    for number in range(count):
+        ids = [f"A_{number:07d}-{candidate}" for candidate in range(candidates)]
+        for id in ids:
+            articles[id] = " ".join(text(rng.randint(50, 400)))
+        gloss = rng.sample(articles[ids[0]].split(), 4) + text(4)
+        cases.append(HomographCase(lexeme_id=f"L{number + 1}",
+                                   gloss=" ".join(gloss),
+                                   candidates=ids))
+    return cases, articles
+
+
+def generate_page(start: int = 0, rows: int = 50, nested_every: int = 0) -> bytes:
+    """A page that looks like the response from admin-ajax.php. With
+    nested_every every that many lemmas have a nested span"""
+    links = []
+    for number in range(start, start + rows):
+        lemma = f"ord{number}"
+        if nested_every and number % nested_every == 0:
+            lemma = f'ord<span class="hom">{number}</span> x'
+        links.append(
+            f'<a class="slank" href="https://svenska.se/saob/?id=A_{number:05d}-0001.aBcD&amp;pz=5">'
+            f'<span class="null"></span>'
+            f'<span class="lemma">{lemma}</span>'
+            f'<span class="category">subst.</span>'
+            f'<span class="number">{number % 3 or ""}</span></a>\n'
+        )
+    return (
+        '<div class="pilupp"><a unik="A_{0:05d}-0001.aBcD">&#9650;</a></div>\n'
+        '<div class="lista">\n{1}</div>\n'
+        '<div class="pilned"><a unik="A_{2:05d}-0001.aBcD">&#9660;</a></div>\n'
+    ).format(start, "".join(links), start + rows - 1).encode("utf-8")
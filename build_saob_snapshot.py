@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# Licensed under GPLv3+ i.e. GPL version 3 or later.
+import argparse
+import logging
+
+import config
+from models.saob_snapshot import SAOBSnapshot
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert the SAOB list from get_saob_list.py to a binary snapshot"
+    )
+    parser.add_argument("csv", nargs="?", default=config.saob_csv,
+                        help=f"SAOB list to convert (default {config.saob_csv})")
+    parser.add_argument("snapshot", nargs="?", default=config.saob_snapshot,
+                        help=f"Snapshot to write (default {config.saob_snapshot})")
+    args = parser.parse_args()
+    SAOBSnapshot.write_from_csv(args.csv, args.snapshot)
+    with SAOBSnapshot(args.snapshot) as snapshot:
+        print(snapshot)
+
+
+if __name__ == "__main__":
+    main()
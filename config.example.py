@@ -12,4 +12,98 @@ match_subentry = False
 login_instance = None
 loglevel = None
 tool_url = "Wikidata:Tools/LexSAOB"
-wd_prefix = "http://www.wikidata.org/entity/"
\ No newline at end of file
+wd_prefix = "http://www.wikidata.org/entity/"
+
+# Dictionary sources to match lexemes against, see models/source.py. The
+# lexemes of a language are fetched once for all its sources.
+sources = ["saob"]
+
+# SAOB list written by get_saob_list.py
+saob_csv = "saob_2021-08-13.csv"
+# Binary snapshot written by build_saob_snapshot.py, used instead of the csv
+# when it exists
+saob_snapshot = "saob_2021-08-13.snapshot"
+
+# Uploads to Wikidata run in the background
+upload_workers = 2
+upload_queue_size = 50
+# Keep this within the bot policy of Wikidata
+edits_per_minute = 60
+# The rate is halved when Wikidata is lagged or throttles us and then
+# raised again, but never below min_edits_per_minute
+min_edits_per_minute = 5
+maxlag = 5
+edit_max_retries = 5
+edit_backoff_base = 5
+edit_backoff_max = 300
+# Check the current state of the lexemes in batches of up to 50 right
+# before uploading and drop the uploads that are no longer needed
+preflight = True
+preflight_batch_size = 50
+preflight_timeout = 30
+
+# Lookups of subentries on saob.se are cached between runs
+subentry_cache_path = "subentry_cache.sqlite"
+subentry_cache_ttl_days = 30
+subentry_cache_max_entries = 200000
+
+# Lookups of lemmas not found in the SAOB list
+saob_timeout = 30
+subentry_concurrency = 8
+# Only look up the lemmas that can be split into a SAOB lemma and a tail
+subentry_split_locally = True
+
+# Article pages downloaded by get_saob_articles.py are stored compressed
+# here. Downloads are limited to be polite to saob.se.
+article_store_path = "saob_articles.sqlite"
+article_concurrency = 4
+article_requests_per_minute = 120
+
+# Lexemes with several SAOB entries with the same category can be ranked by
+# comparing the glosses of their senses with the articles of the entries.
+# An entry is clearly the best if its score is at least homograph_min_score
+# and homograph_margin more than the second best. All ranked lexemes are
+# written to homograph_review_path. The thresholds are not validated yet so
+# clear entries are only added with homograph_auto_add. Articles are only
+# downloaded by run, plan uses those in the article store.
+rank_homographs = False
+homograph_auto_add = False
+homograph_min_score = 0.1
+homograph_margin = 0.05
+homograph_batch_size = 512
+homograph_review_path = "homograph_review.jsonl"
+
+# Fetching lexemes from WDQS, WDQS allows 5 parallel queries
+sparql_page_size = 10000
+sparql_workers = 4
+
+# Read lexemes from a local lexeme dump instead of WDQS, e.g.
+# "latest-lexemes.json.gz" from https://dumps.wikimedia.org/wikidatawiki/entities/
+lexeme_dump = None
+
+# Timers, counters and latency histograms of a run are written here at the
+# end of the run and every metrics_interval seconds if it is set
+metrics_json = "lexsaob_metrics.json"
+metrics_prometheus = "lexsaob_metrics.prom"
+metrics_interval = None
+
+# Match the lexemes in this many processes, e.g. os.cpu_count()
+# Needs the SAOB snapshot when uploading at the same time
+match_processes = 1
+
+# Sort the lexemes by lemma and merge join them with the SAOB snapshot
+# instead of looking up every lexeme. Memory stays the same no matter how
+# many lexemes there are. At most merge_join_run_size lexemes are sorted
+# in memory at a time, the rest is spilled to temporary files.
+merge_join = False
+merge_join_run_size = 100000
+
+# All requests to SAOB, WDQS and the Wikidata API, the edits included,
+# go through one pooled client, see models/http_client.py. Edits and the
+# fetches they are based on are not retried by it but by the edit
+# scheduler, see edit_max_retries
+http_connect_timeout = 10
+http_timeout = 60
+http_max_retries = 3
+http_backoff = 1
+http_per_host_concurrency = 8
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Licensed under GPLv3+ i.e. GPL version 3 or later.
+import argparse
+import logging
+from typing import Iterator
+
+import config
+from models import saob, saob_category
+from models.article_store import ArticleStore
+from models.saob_snapshot import SAOBSnapshot
+from models.source import SAOBSource
+
+logging.basicConfig(level=logging.INFO)
+
+
+def read_entries(homographs_only: bool = False) -> Iterator[saob.SAOBEntry]:
+    """All entries in the SAOB snapshot or list. With homographs_only
+    only entries sharing lemma and lexical category with another entry,
+    the ones process_lexemes() cannot choose between. Entries without a
+    recognized category never match a lexeme so they are left out"""
+    index = SAOBSource().load_index()
+    groups = index.groups() if isinstance(index, SAOBSnapshot) else index.values()
+    for group in groups:
+        if homographs_only:
+            for category_qid, entries in group.entries_by_category.items():
+                if category_qid not in saob_category.NOT_QIDS and len(entries) > 1:
+                    yield from entries
+        else:
+            yield from group
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download SAOB article pages into the local article store"
+    )
+    parser.add_argument("--homographs", action="store_true",
+                        help="only the entries that share lemma and lexical category "
+                             "with another entry")
+    parser.add_argument("--refetch", action="store_true",
+                        help="download pages already in the store again")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="delete pages no entry has and shrink the store, "
+                             "without downloading")
+    parser.add_argument("--store", default=config.article_store_path,
+                        help=f"article store to write to (default {config.article_store_path})")
+    args = parser.parse_args()
+    with ArticleStore(args.store) as store:
+        if args.vacuum:
+            print(f"Deleted {store.vacuum()} unused pages")
+            print(store)
+            return
+        fetched_count = saob.scrape_details(read_entries(homographs_only=args.homographs),
+                                            store=store, refetch=args.refetch)
+        print(f"Downloaded {fetched_count} articles")
+        print(store)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,54 +2,347 @@
 
 # Code from https://gist.github.com/salgo60/73dc99d71fcdeb75e4d69bd73b71acf9
 # based on https://github.com/Torbacka/wordlist/blob/master/client.py
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from csv import reader, writer
 from datetime import datetime
-import requests
+from typing import List, Dict, Tuple, Set, Union
+from urllib.parse import urlparse, parse_qsl
+
 from bs4 import BeautifulSoup
 
-data = {
-    'action': 'myprefix_scrollist',
-    'unik': '0',
-    'dir': 'ned',
-    'dict': 'saob'
-}
+from models import saob_list_page
+from models.http_client import shared_client
+
+url = 'https://svenska.se/wp-admin/admin-ajax.php'
 headers = {
     'User-Agent': 'Mozilla/5.0 (X11; Fedora; Linux x86_64; rv:63.0) Gecko/20100101 Firefox/63.0'
 }
-date = datetime.today().strftime("%Y-%m-%d")
-print(date)
-file = open(f"saob_{date}.csv", "a")
+max_pages = 20000
 
 
-def main():
-    for i in range(1, 20000):
-        if i % 10 == 0:
-            print(i)
-        response = requests.post('https://svenska.se/wp-admin/admin-ajax.php', data=data, headers=headers)
-        unik = parse_response(response)
-        if unik == -1:
+class Segment:
+    """A part of the list crawled from a seed cursor in one direction
+
+    "ned" walks down the list (forward) and "upp" walks up (backwards).
+    The segment stops when it reaches ids claimed by another segment.
+    Rows are kept in the order they were crawled."""
+    seed: str
+    position: int  # the position of the seed in the alphabet
+    direction: str
+    cursor: str
+    page_count: int
+    done: bool
+    crawled_rows: List[List[str]]
+    pending_rows: List[List[str]]  # rows not yet saved to the checkpoint
+    saved_state: Union[Dict, None]  # state at the last checkpoint
+
+    def __init__(self, seed: str, position: int, direction: str):
+        self.seed = seed
+        self.position = position
+        self.direction = direction
+        self.cursor = seed
+        self.page_count = 0
+        self.done = False
+        self.crawled_rows = []
+        self.pending_rows = []
+        self.saved_state = None
+
+    def __str__(self):
+        return f"{self.direction} from {self.seed}"
+
+    def name(self):
+        return f"{self.position}-{self.direction}"
+
+    def add_page(self, rows: List[List[str]]):
+        # Walking up we see the pages in reverse order
+        if self.direction == "upp":
+            rows = list(reversed(rows))
+        self.crawled_rows += rows
+        self.pending_rows += rows
+
+    def rows(self):
+        """Rows in alphabetical order"""
+        if self.direction == "upp":
+            return reversed(self.crawled_rows)
+        return iter(self.crawled_rows)
+
+
+class Crawler:
+    """Crawl the list from several seed cursors in parallel
+
+    If a state_dir is given the rows and cursor of every segment are
+    saved there every checkpoint_interval pages and a new Crawler with
+    the same seeds and state_dir resumes from the last checkpoint."""
+    segments: List[Segment]
+    claimed: Dict[str, Segment]
+    state_dir: Union[str, None]
+    checkpoint_interval = 10
+
+    def __init__(self, seeds: List[str] = None, workers: int = 1, state_dir: str = None):
+        if seeds is None:
+            seeds = ['0']
+        self.seeds = seeds
+        self.workers = workers
+        self.state_dir = state_dir
+        self.segments = []
+        for position, seed in enumerate(seeds):
+            # There is nothing above the start of the list
+            if seed != '0':
+                self.segments.append(Segment(seed, position, "upp"))
+            self.segments.append(Segment(seed, position, "ned"))
+        self.claimed = {}
+        self.lock = threading.Lock()
+        if state_dir is not None:
+            self.load_checkpoint()
+
+    def checkpoint_path(self):
+        return os.path.join(self.state_dir, "checkpoint.json")
+
+    def segment_path(self, segment: Segment):
+        return os.path.join(self.state_dir, f"{segment.name()}.csv")
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path()):
+            os.makedirs(self.state_dir, exist_ok=True)
+            return
+        with open(self.checkpoint_path()) as file:
+            checkpoint = json.load(file)
+        if checkpoint["seeds"] != self.seeds:
+            raise Exception(f"The checkpoint in {self.state_dir} was made with other "
+                            f"seeds, remove it to start over")
+        for segment in self.segments:
+            state = checkpoint["segments"].get(segment.name())
+            if state is None:
+                continue
+            segment.cursor = state["cursor"]
+            segment.page_count = state["page_count"]
+            segment.done = state["done"]
+            segment.saved_state = state
+            # Rows after the last checkpoint are fetched again and
+            # skipped below because they are already claimed
+            with open(self.segment_path(segment), 'r') as read_obj:
+                for row in reader(read_obj):
+                    id = extract_id(row)
+                    if id not in self.claimed:
+                        self.claimed[id] = segment
+                        segment.crawled_rows.append(row)
+        print(f"Resuming from checkpoint with {len(self.claimed)} rows")
+
+    def save_checkpoint(self, segment: Segment):
+        """Append the new rows of the segment to its file and then save
+        the cursors of all segments"""
+        with open(self.segment_path(segment), "a", newline="") as file:
+            write_rows(file, segment.pending_rows)
+            file.flush()
+            os.fsync(file.fileno())
+        segment.pending_rows = []
+        with self.lock:
+            segment.saved_state = {
+                "cursor": segment.cursor,
+                "page_count": segment.page_count,
+                "done": segment.done
+            }
+            # Other segments are saved as they were at their last checkpoint
+            checkpoint = {
+                "seeds": self.seeds,
+                "segments": {
+                    s.name(): s.saved_state
+                    for s in self.segments if s.saved_state is not None
+                }
+            }
+            temporary_path = self.checkpoint_path() + ".tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(checkpoint, file)
+            os.replace(temporary_path, self.checkpoint_path())
+
+    def remove_checkpoint(self):
+        if self.state_dir is not None:
+            shutil.rmtree(self.state_dir)
+
+    def crawl(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # list() reraises exceptions from the workers
+            list(executor.map(self.crawl_segment, self.segments))
+        return self.merge()
+
+    def crawl_segment(self, segment: Segment):
+        while not segment.done and segment.page_count < max_pages:
+            segment.page_count += 1
+            if segment.page_count % 10 == 0:
+                print(segment, segment.page_count)
+            # The seed itself is only on the first page of the ned segment
+            keep_cursor = (segment.page_count == 1 and
+                           segment.direction == "ned" and
+                           segment.seed != '0')
+            rows, unik = fetch_page(segment.cursor, segment.direction, keep_cursor=keep_cursor)
+            new_rows = []
+            reached_other_segment = False
+            with self.lock:
+                for row in rows:
+                    id = extract_id(row)
+                    # Rows we already have are skipped so that writes
+                    # are idempotent when resuming
+                    if id not in self.claimed:
+                        self.claimed[id] = segment
+                        new_rows.append(row)
+                    elif self.claimed[id] is not segment:
+                        reached_other_segment = True
+            segment.add_page(new_rows)
+            segment.cursor = unik
+            segment.done = (unik == -1 or reached_other_segment)
+            if self.state_dir is not None and (
+                    segment.done or segment.page_count % self.checkpoint_interval == 0):
+                self.save_checkpoint(segment)
+        print(f"Done with {segment} after {segment.page_count} pages")
+
+    def merge(self):
+        """Return all rows ordered by seed and without duplicates"""
+        seen = set()
+        rows = []
+        for segment in sorted(self.segments,
+                              key=lambda s: (s.position, s.direction != "upp")):
+            for row in segment.rows():
+                id = extract_id(row)
+                if id not in seen:
+                    seen.add(id)
+                    rows.append(row)
+        return rows
+
+
+def crawl_incremental(known_ids: Set[str], last_id: str):
+    """Crawl down from the last known article and return the rows
+    of new articles. SAOB publishes roughly in alphabetical order so
+    we stop at the end of the list or as soon as we see known ids."""
+    rows = []
+    unik = last_id
+    for i in range(1, max_pages):
+        page, unik = fetch_page(unik, "ned")
+        new_rows = [row for row in page if extract_id(row) not in known_ids]
+        rows += new_rows
+        if unik == -1 or len(new_rows) < len(page):
             break
-        data['unik'] = unik
+    print(f"Found {len(rows)} new articles after {i} pages")
+    return rows
+
+
+def read_ids(path: str) -> List[str]:
+    """Ids of a previous list in the order of the list"""
+    with open(path, 'r') as read_obj:
+        return [extract_id(row) for row in reader(read_obj)]
+
+
+def read_seeds(path: str, count: int) -> List[str]:
+    """Pick count seed cursors spread evenly over a previous list"""
+    ids = read_ids(path)
+    seeds = ['0']
+    for number in range(1, count):
+        seeds.append(ids[len(ids) * number // count])
+    return seeds
+
+
+def extract_id(row: List[str]) -> str:
+    return dict(parse_qsl(urlparse(row[4]).query))["id"]
+
+
+def fetch_page(unik: str,
+               direction: str = "ned",
+               keep_cursor: bool = False) -> Tuple[List[List[str]], str]:
+    data = {
+        'action': 'myprefix_scrollist',
+        'unik': unik,
+        'dir': direction,
+        'dict': 'saob'
+    }
+    response = shared_client().post(url, data=data, headers=headers)
+    return saob_list_page.extract_rows(response.content, direction, keep_cursor=keep_cursor)
 
 
 # Parse the html response from svenska.se
-def parse_response(response):
+def parse_response(response, direction: str = "ned", keep_cursor: bool = False):
+    """Return the rows on the page and the next cursor
+    which is -1 at the end of the list
+
+    This builds a whole BeautifulSoup tree and is kept as the reference
+    for the faster saob_list_page.extract_rows() which fetch_page() uses,
+    see benchmarks/bench_page_parser.py"""
     soup = BeautifulSoup(response.text, features="html.parser")
     links = soup.findAll("a", class_='slank')
     if len(links) == 0:
-        return -1
-    for link in links[1:]:
-        gather_information(link)
-    div = soup.findAll("div", class_='pilned')
-    return div[0].a['unik']
+        return [], -1
+    # The link of the cursor is repeated on the page
+    if not keep_cursor:
+        if direction == "upp":
+            links = links[:-1]
+        else:
+            links = links[1:]
+    rows = [gather_information(link) for link in links]
+    div = soup.findAll("div", class_=f'pil{direction}')
+    if len(div) == 0 or div[0].a is None:
+        raise Exception(f"Could not find the next cursor on the page: {response.text[:200]}")
+    return rows, div[0].a['unik']
 
 
 def gather_information(link):
     span = link.findAll('span')
-    file.write(span[0].getText().strip() +
-               "," + span[1].getText().strip() +
-               "," + span[2].getText().strip() +
-               "," + span[3].getText().strip() +
-               "," + link['href'].strip() + "\n")
+    return [span[0].getText().strip(),
+            span[1].getText().strip(),
+            span[2].getText().strip(),
+            span[3].getText().strip(),
+            link['href'].strip()]
+
+
+def write_rows(file, rows):
+    writer(file, lineterminator="\n").writerows(rows)
+
+
+def main():
+    logger = logging.getLogger(__name__)
+    parser = argparse.ArgumentParser(description="Download the list of words in SAOB")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of segments crawled in parallel")
+    parser.add_argument("--seed-list",
+                        help="previous list used to spread the seed cursors "
+                             "over the alphabet, one seed per worker")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the checkpoint of an earlier failed crawl today")
+    parser.add_argument("--incremental", metavar="PREVIOUS_LIST",
+                        help="only fetch articles published after the last "
+                             "article in the previous list and write them "
+                             "to a delta file")
+    args = parser.parse_args()
+    date = datetime.today().strftime("%Y-%m-%d")
+    print(date)
+    if args.incremental:
+        known_ids = read_ids(args.incremental)
+        if known_ids:
+            rows = crawl_incremental(known_ids=set(known_ids), last_id=known_ids[-1])
+            with open(f"saob_delta_{date}.csv", "w", newline="") as file:
+                write_rows(file, rows)
+            print(f"Wrote {len(rows)} rows to saob_delta_{date}.csv")
+            return
+        # E.g. the list of a crawl that crashed
+        logger.warning(f"{args.incremental} has no articles to continue after, "
+                       f"downloading the whole list instead")
+    if args.seed_list:
+        seeds = read_seeds(args.seed_list, args.workers)
+    else:
+        seeds = ['0']
+    # A failed crawl is resumed from here when run again the same day
+    state_dir = f"saob_{date}.parts"
+    if args.restart and os.path.exists(state_dir):
+        shutil.rmtree(state_dir)
+    crawler = Crawler(seeds=seeds, workers=args.workers, state_dir=state_dir)
+    rows = crawler.crawl()
+    with open(f"saob_{date}.csv", "w", newline="") as file:
+        write_rows(file, rows)
+    print(f"Wrote {len(rows)} rows to saob_{date}.csv")
+    crawler.remove_checkpoint()
 
 
 if __name__ == '__main__':
@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
 # Licensed under GPLv3+ i.e. GPL version 3 or later.
+import argparse
 import logging
-from csv import reader
-from typing import List, Dict
-from urllib.parse import urlparse, parse_qsl
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
+from typing import List, Dict, Union, Set, Tuple, Iterable
 
 from wikibaseintegrator import wbi_login
 from wikibaseintegrator import wbi_config
 
 import config
-from models import wikidata, saob
+from models import wikidata, saob, saob_category, plan
 
 # Constants
-from models.saob import SAOBSubentry
+from models.saob import resolve_subentries
+from models.article_store import ArticleStore
+from models.compound import CompoundSplitter
+from models.homograph_ranker import HomographCase, HomographRanker
+from models.lexeme_dump import LexemeDump
+from models.merge_join import merge_join, sort_lexemes_by_lemma
+from models.metrics import metrics
+from models.plan import MatchAction, MatchPlanWriter, PlanEntry, read_plan
+from models.preflight import Preflight
+from models.saob_snapshot import SAOBSnapshot
+from models.source import DictionarySource, SAOBSource, enabled_sources, source_for_property
+from models.subentry_cache import SubentryCache
+from models.uploader import BatchUploader
 from models.wikidata import LexemeLanguage, ForeignID
 
 wd_prefix = "http://www.wikidata.org/entity/"
@@ -41,249 +59,625 @@ def check_matching_category(lexeme: wikidata.Lexeme = None,
     # if not count_only:
     #     logger.info(f"found match: category: {saob_entry.lexical_category} id: {saob_entry.id}")
     # check if categories match
-    category = None
-    if saob_entry.lexical_category == "" or saob_entry.lexical_category is None:
+    # The category in SAOB is classified once per distinct string, see models/saob_category.py
+    category = saob_entry.category_qid()
+    if category == saob_category.NO_CATEGORY:
         if not count_only:
             logging.info("No category found")
-    elif "verb" in saob_entry.lexical_category:
-        category = "Q24905"
-    elif "subst" in saob_entry.lexical_category:
-        if "-" in saob_entry.lemma:
-            # handle affixes like -fil also being marked as subst in SAOB
-            category = "Q62155"
-        else:
-            category = "Q1084"
-    elif "adj" in saob_entry.lexical_category:
-        category = "Q34698"
-    elif "adv" in saob_entry.lexical_category:
-        category = "Q380057"
-    elif "konj" in saob_entry.lexical_category:
-        category = "Q36484"
-    elif "interj" in saob_entry.lexical_category:
-        category = "Q83034"
-    elif "prep" in saob_entry.lexical_category:
-        category = "Q4833830"
-    elif "räkn" in saob_entry.lexical_category:
-        category = "Q63116"
-    elif "artikel" in saob_entry.lexical_category:
-        category = "Q103184"
-    elif "pron" in saob_entry.lexical_category:
-        category = "Q36224"
-    elif (
-        saob_entry.lexical_category == "prefix" or
-        saob_entry.lexical_category == "suffix" or
-        saob_entry.lexical_category == "affix"
-    ):
-        category = "Q62155"
-    elif (
-        # this covers all special cases like this one: https://svenska.se/saob/?id=O_0283-0242.Qqdq&pz=5
-        "(" in saob_entry.lexical_category or
-        "ssgled" in saob_entry.lexical_category
-    ):
+        return False
+    elif category == saob_category.IGNORE:
         # ignore silently
         return False
-    else:
+    elif category == saob_category.UNKNOWN:
         if not count_only:
             logging.error(f"Did not recognize category "
                           f"{saob_entry.lexical_category} on "
                           f"{saob_entry.url()}, skipping")
-            return False
-    if category is not None:
-        if category == lexeme.lexical_category:
-            return True
-        else:
-            if not count_only:
-                logging.info("Categories did not match, skipping")
-            return False
-
-
-def load_saob_into_memory():
-    # load all saab words into a list that can be searched
-    # load all saab ids into a list we can lookup in using the index.
-    # the two lists above have the same index.
-    # load all saob lines into a dictionary with count as key and list in the value
-    #list[0] = saob_category
-    #list[1] = number
-    #list[2] = id
-    #list[3] = word
-    print("Loading SAOB into memory")
-    saob_lemma_list = []
-    saob_data = {}
-    # open file in read mode
-    with open('saob_2021-08-13.csv', 'r') as read_obj:
-        # pass the file object to reader() to get the reader object
-        csv_reader = reader(read_obj)
-        count = 0
-        # Iterate over each row in the csv using reader object
-        for row in csv_reader:
-            # row variable is a list that represents a row in csv
-            #row0 is null
-            word = row[1]
-            saob_category = row[2]
-            if row[3] == '':
-                saob_number = 0
-            else:
-                saob_number = int(row[3])
-            url = urlparse(row[4])
-            # print(url.query)
-            saob_id = dict(parse_qsl(url.query))["id"]
-            # Create object
-            entry = saob.SAOBEntry(
-                id=saob_id,
-                lexical_category=saob_category,
-                number=saob_number,
-                lemma=word
-            )
-            saob_data[count] = entry #[saob_category, saob_number, saob_id, word]
-            saob_lemma_list.append(word)
-            count += 1
-    print(f"loaded {count} saob lines into dictionary with length {len(saob_data)}")
-    print(f"loaded {count} saob lines into list with length {len(saob_lemma_list)}")
-    # exit(0)
-    return saob_lemma_list, saob_data
-
-
-def process_lexemes(lexeme_lemma_list: List = None,
-                    lexemes_data: Dict = None,
-                    saob_lemma_list: List = None,
-                    saob_data: Dict = None):
-    if (
-        lexeme_lemma_list is None or
-        lexemes_data is None or
-        saob_lemma_list is None or
-        saob_data is None
-    ):
-        logger.exception("Did not get what we need")
-    lexemes_count = len(lexeme_lemma_list)
-    # go through all lexemes missing SAOB identifier
-    match_count = 0
+        return False
+    elif category == lexeme.lexical_category:
+        return True
+    else:
+        if not count_only:
+            logging.info("Categories did not match, skipping")
+        return False
+
+
+def match_lexeme(lexeme: wikidata.Lexeme = None,
+                 saob_lemma_index: Union[Dict[str, saob.SAOBLemmaGroup], SAOBSnapshot] = None,
+                 source: DictionarySource = None) -> PlanEntry:
+    """Decide what to upload for a lexeme without uploading anything"""
+    if lexeme is None or saob_lemma_index is None:
+        raise ValueError("Did not get the arguments needed")
+    # One lookup gives all SAOB entries (homographs) with this lemma
+    return match_lexeme_to_group(lexeme, saob_lemma_index.get(lexeme.lemma), source)
+
+
+def match_lexeme_to_group(lexeme: wikidata.Lexeme,
+                          group: saob.SAOBLemmaGroup = None,
+                          source: DictionarySource = None) -> PlanEntry:
+    """Decide what to upload for a lexeme given the entries of the
+    source (SAOB by default) with its lemma or None if the lemma is
+    not in the source"""
+    if source is None:
+        source = SAOBSource()
+    decision = partial(PlanEntry,
+                       lexeme_id=lexeme.id,
+                       lemma=lexeme.lemma,
+                       lexical_category=lexeme.lexical_category,
+                       property=source.property,
+                       stated_in=source.stated_in)
+    if group is None:
+        if source.add_no_value:
+            return decision(action=MatchAction.NO_VALUE, reason=source.not_found_reason)
+        return decision(action=MatchAction.SKIP, reason=source.not_found_reason)
+    # The entries are grouped by category when the index is built
+    matches = group.matches(lexeme.lexical_category)
+    if len(matches) == 1:
+        return decision(action=MatchAction.ADD, saob_id=matches[0].id,
+                        reason=plan.UNIQUE_MATCH)
+    elif len(matches) > 1:
+        # These can be ranked by their definitions later, see rank_homographs()
+        return decision(action=MatchAction.SKIP, reason=plan.MULTIPLE_MATCHES,
+                        candidates=[entry.id for entry in matches])
+    else:
+        return decision(action=MatchAction.SKIP, reason=plan.NO_MATCHING_CATEGORY)
+
+
+def match_serially(lexemes: List[wikidata.Lexeme],
+                   saob_lemma_index: Union[Dict[str, saob.SAOBLemmaGroup], SAOBSnapshot],
+                   source: DictionarySource,
+                   uploader: BatchUploader = None,
+                   plan_writer: MatchPlanWriter = None):
+    """Match the lexemes one by one in this process
+    Returns the number of decisions per action and per reason,
+    the lemmas not found in SAOB and the decisions held back to be
+    ranked, see rank_homographs()"""
+    return match_pairs(((lexeme, saob_lemma_index.get(lexeme.lemma)) for lexeme in lexemes),
+                       source, lexemes_count=len(lexemes), uploader=uploader,
+                       plan_writer=plan_writer)
+
+
+def match_pairs(pairs: Iterable[Tuple[wikidata.Lexeme, saob.SAOBLemmaGroup]],
+                source: DictionarySource,
+                lexemes_count: int = None,
+                uploader: BatchUploader = None,
+                plan_writer: MatchPlanWriter = None):
+    """See match_serially(). The pairs are lexemes and the SAOB lemma
+    group of their lemma or None"""
+    action_counts = Counter()
+    reason_counts = Counter()
+    unmatched_lemmas = []
+    homographs = []
     processed_count = 0
-    skipped_multiple_matches = 0
-    no_value_count = 0
-    if count_only:
-        print("Counting all matches that can be uploaded")
-    for lemma in lexeme_lemma_list:
+    for lexeme, group in pairs:
         if processed_count > 0 and processed_count % 1000 == 0:
-            print(f"Processed {processed_count} lexemes out of "
-                  f"{lexemes_count} ({round(processed_count * 100 / lexemes_count)}%)")
-        lexeme: wikidata.Lexeme = lexemes_data[lemma]
+            if lexemes_count is None:
+                print(f"Processed {processed_count} lexemes")
+            else:
+                print(f"Processed {processed_count} lexemes out of "
+                      f"{lexemes_count} ({round(processed_count * 100 / lexemes_count)}%)")
         if not count_only:
             logging.info(f"Working on {lexeme.id}: {lexeme.lemma} {lexeme.lexical_category}")
-        value_count = 0
-        matching_saob_indexes = []
-        if lexeme.lemma in saob_lemma_list:
-            # Count number of hits
-            for count, saob_lemma in enumerate(saob_lemma_list):
-                if saob_lemma == lexeme.lemma:
-                    # print(count, value)
-                    matching_saob_indexes.append(count)
-                    value_count += 1
-            if value_count > 1:
-                if not count_only:
-                    logger.debug(f"Found more than 1 matching lemma = complex")
-                    adj_count = 0
-                    subst_count = 0
-                    verb_count = 0
-                    adjective_regex = "adj"
-                    for index in matching_saob_indexes:
-                        entry = saob_data[index]
-                        if "subst" in entry.lexical_category:
-                            logging.debug(f"Detected noun: {entry.lexical_category}")
-                            subst_count += 1
-                        if "verb" in entry.lexical_category:
-                            logging.debug(f"Detected verb: {entry.lexical_category}")
-                            verb_count += 1
-                        if "adj" in entry.lexical_category:
-                            logging.debug(f"Detected adjective: {entry.lexical_category}")
-                            adj_count += 1
-                    for index in matching_saob_indexes:
-                        entry = saob_data[index]
-                        logging.debug(f"index {index} lemma: {entry.lemma} {entry.lexical_category} "
-                                      f"number {entry.number}, see {entry.url()}")
-                        result: bool = check_matching_category(lexeme=lexeme,
-                                                               saob_entry=entry)
-                        if result:
-                            logging.info("Categories match")
-                            match_count += 1
-                            if not count_only:
-                                if entry.lexical_category == "subst":
-                                    if subst_count > 1:
-                                        logging.info("More that one noun found. Skipping")
-                                        skipped_multiple_matches += 1
-                                        continue
-                                if entry.lexical_category == "verb":
-                                    if verb_count > 1:
-                                        logging.info("More that one verb found. Skipping")
-                                        skipped_multiple_matches += 1
-                                        continue
-                                if entry.lexical_category == "adj":
-                                    if adj_count > 1:
-                                        logging.info("More that one adj found. Skipping")
-                                        skipped_multiple_matches += 1
-                                        continue
-                                # TODO scrape entry definitions from saob and let the user decide
-                                # whether any match the senses of the lexeme if any
-                                lexeme.upload_foreign_id_to_wikidata(foreign_id=ForeignID(
-                                    id=entry.id,
-                                    property="P8478",
-                                    source_item_id="Q1935308"
-                                ))
-            elif value_count == 1:
-                # Only 1 search result in the saob wordlist so pick it
-                entry = saob_data[matching_saob_indexes[0]]
-                logger.debug(f"Only 1 matching lemma, see {entry.url()}")
-                result = check_matching_category(lexeme=lexeme,
-                                                 saob_entry=entry)
-                if result:
-                    match_count += 1
-                    if not count_only:
-                        lexeme.upload_foreign_id_to_wikidata(foreign_id=ForeignID(
-                            id=entry.id,
-                            property="P8478",
-                            source_item_id="Q1935308"
-                        ))
-        else:
-            if not count_only:
-                logging.debug(f"{lexeme.lemma} not found in SAOB wordlist")
-                if config.add_no_value:
-                    # Add SAOB=no_value to lexeme
-                    lexeme.upload_foreign_id_to_wikidata(foreign_id=ForeignID(
-                        property="P8478",
-                        no_value=True
-                    ))
-                no_value_count += 1
-                if config.match_subentry:
-                    logger.info("Searching for the lemma on saob.se to find a subentry")
-                    subentry = SAOBSubentry(lexeme.lemma)
-                    found = subentry.search_using_api()
-                    if found:
-                        logger.info(f"Found subentry match for {lexeme.lemma}")
-                        # Add new property (to be proposed) SAOB section ID
-                        # TODO upload once new property is proposed and created
+        entry = match_lexeme_to_group(lexeme, group, source)
+        if not count_only:
+            logging.info(entry)
+        action_counts[entry.action] += 1
+        reason_counts[entry.reason] += 1
+        if entry.reason == source.not_found_reason and source.has_subentries and config.match_subentry:
+            # These are searched for on saob.se all at once later
+            unmatched_lemmas.append(lexeme.lemma)
         processed_count += 1
+        if entry.reason == plan.MULTIPLE_MATCHES and source.has_articles and config.rank_homographs:
+            # These are ranked all at once later
+            homographs.append(entry)
+            continue
+        if plan_writer is not None:
+            plan_writer.write(entry)
+        if uploader is not None and entry.action != MatchAction.SKIP:
+            uploader.submit(lexeme=lexeme, foreign_id=entry.foreign_id(source))
+    return action_counts, reason_counts, unmatched_lemmas, homographs
+
+
+# Inherited by the matching processes when they are forked, see match_in_parallel()
+shared_lexemes: List[wikidata.Lexeme] = None
+shared_index: Union[Dict[str, saob.SAOBLemmaGroup], SAOBSnapshot] = None
+
+
+def init_matching_process(snapshot_path: str = None):
+    global shared_index
+    if snapshot_path is not None:
+        # Every process maps the same file so the pages are shared
+        # and nothing is copied
+        shared_index = SAOBSnapshot(snapshot_path)
+
+
+def match_shard(shard: Tuple[int, int, List[wikidata.Lexeme]],
+                source: DictionarySource = None,
+                write_plan: bool = False,
+                collect_uploads: bool = False,
+                collect_unmatched: bool = False,
+                hold_homographs: bool = False):
+    """Match shared_lexemes[start:end] or the lexemes in the shard
+    in a matching process
+
+    Only the counts, the plan lines and the entries to upload are sent back
+    to the main process. The switches from config are passed in because a
+    spawned process reads config.py again."""
+    start, end, lexemes = shard
+    if lexemes is None:
+        lexemes = shared_lexemes[start:end]
+    action_counts = Counter()
+    reason_counts = Counter()
+    plan_lines = []
+    uploads = []
+    unmatched_lemmas = []
+    homographs = []
+    for position, lexeme in enumerate(lexemes, start):
+        entry = match_lexeme(lexeme=lexeme, saob_lemma_index=shared_index, source=source)
+        action_counts[entry.action] += 1
+        reason_counts[entry.reason] += 1
+        if entry.reason == source.not_found_reason and collect_unmatched:
+            # These are searched for on saob.se all at once later
+            unmatched_lemmas.append(lexeme.lemma)
+        if entry.reason == plan.MULTIPLE_MATCHES and hold_homographs:
+            homographs.append(entry)
+            continue
+        if write_plan:
+            plan_lines.append(entry.to_json() + "\n")
+        if collect_uploads and entry.action != MatchAction.SKIP:
+            uploads.append((position, entry))
+    return (action_counts, reason_counts, plan_lines, uploads, unmatched_lemmas,
+            homographs, saob_category.unrecognized_categories)
+
+
+def match_in_parallel(lexemes: List[wikidata.Lexeme],
+                      saob_lemma_index: Union[Dict[str, saob.SAOBLemmaGroup], SAOBSnapshot],
+                      processes: int,
+                      source: DictionarySource,
+                      uploader: BatchUploader = None,
+                      plan_writer: MatchPlanWriter = None):
+    """Same as match_serially() but the lexemes are split in shards
+    that are matched by a pool of processes
+
+    The SAOB index is never pickled. A snapshot is opened again in every
+    process so they all share the pages of the same file. The processes
+    are started with forkserver or spawn and not forked because the
+    uploader, the metrics exporter and the HTTP client may be running
+    threads, and a forked process inherits the locks they hold. An index
+    in memory can only be shared by forking, so the processes inherit the
+    lexemes and the index, and it is only done when no other thread runs.
+    Otherwise the lexemes are matched serially. Shards are consumed in
+    order so the plan and the uploads come out in the same order as when
+    matching serially."""
+    global shared_lexemes, shared_index
+    is_snapshot = isinstance(saob_lemma_index, SAOBSnapshot)
+    start_methods = multiprocessing.get_all_start_methods()
+    if is_snapshot:
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in start_methods else "spawn")
+    elif "fork" not in start_methods:
+        raise Exception("Matching in parallel without fork needs a SAOB snapshot, "
+                        "run build_saob_snapshot.py")
+    elif threading.active_count() > 1:
+        logger.warning("Matching in one process because forking while other threads "
+                       "run can deadlock. Run build_saob_snapshot.py to match in parallel")
+        return match_serially(lexemes, saob_lemma_index, source, uploader=uploader,
+                              plan_writer=plan_writer)
+    else:
+        context = multiprocessing.get_context("fork")
+    inherit = context.get_start_method() == "fork"
+    shared_lexemes = lexemes
+    shared_index = saob_lemma_index
+    lexemes_count = len(lexemes)
+    # A few shards per process evens out the load
+    shard_size = max(1, -(-lexemes_count // (processes * 4)))
+    shards = [(start, min(start + shard_size, lexemes_count))
+              for start in range(0, lexemes_count, shard_size)]
+    action_counts = Counter()
+    reason_counts = Counter()
+    unmatched_lemmas = []
+    homographs = []
+    print(f"Matching {lexemes_count} lexemes in {len(shards)} shards "
+          f"using {processes} processes")
+    with context.Pool(processes,
+                      initializer=init_matching_process,
+                      initargs=(saob_lemma_index.path if is_snapshot else None,)) as pool:
+        results = pool.imap(
+            partial(match_shard,
+                    source=source,
+                    write_plan=plan_writer is not None,
+                    collect_uploads=uploader is not None,
+                    collect_unmatched=source.has_subentries and config.match_subentry,
+                    hold_homographs=source.has_articles and config.rank_homographs),
+            [(start, end, None if inherit else lexemes[start:end])
+             for start, end in shards]
+        )
+        for (start, end), (shard_actions, shard_reasons, plan_lines, uploads,
+                           shard_unmatched, shard_homographs,
+                           unrecognized) in zip(shards, results):
+            action_counts.update(shard_actions)
+            reason_counts.update(shard_reasons)
+            unmatched_lemmas += shard_unmatched
+            homographs += shard_homographs
+            saob_category.unrecognized_categories.update(unrecognized)
+            if plan_writer is not None:
+                plan_writer.write_lines(plan_lines)
+            for position, entry in uploads:
+                uploader.submit(lexeme=lexemes[position], foreign_id=entry.foreign_id(source))
+            print(f"Processed {end} lexemes out of "
+                  f"{lexemes_count} ({round(end * 100 / lexemes_count)}%)")
+    shared_lexemes = None
+    return action_counts, reason_counts, unmatched_lemmas, homographs
+
+
+def process_lexemes(lexemes: Iterable[wikidata.Lexeme] = None,
+                    saob_lemma_index: Union[Dict[str, saob.SAOBLemmaGroup], SAOBSnapshot] = None,
+                    uploader: BatchUploader = None,
+                    plan_writer: MatchPlanWriter = None,
+                    processes: int = None,
+                    merge: bool = None,
+                    source: DictionarySource = None):
+    """Match all lexemes that lack the property of the source (SAOB by
+    default) against the lemma index of the source and submit the uploads
+    to the uploader and/or write the decisions to the plan
+
+    With more than one process the lexemes are matched in parallel,
+    see match_in_parallel(). With merge the lexemes can be any iterable
+    and are sorted by lemma and merge joined with the snapshot in
+    constant memory, see models/merge_join.py. An index that is not a
+    snapshot is looked up instead if the lexemes are in a list."""
+    if lexemes is None or saob_lemma_index is None:
+        logger.exception("Did not get what we need")
+    if processes is None:
+        processes = config.match_processes
+    if merge is None:
+        merge = config.merge_join
+    if source is None:
+        source = SAOBSource()
+    if merge and not isinstance(saob_lemma_index, SAOBSnapshot):
+        if not isinstance(lexemes, list):
+            raise Exception("Merge join needs a SAOB snapshot, run build_saob_snapshot.py")
+        # Sources without a snapshot are matched by lookups in their index
+        logger.info(f"{source} has no snapshot to merge join with, looking up the lexemes")
+        merge = False
+    if merge:
+        lexemes = (lexeme for lexeme in lexemes if source.lacks(lexeme))
+    else:
+        lexemes = [lexeme for lexeme in lexemes if source.lacks(lexeme)]
+    subentry_cache = None
+    if source.has_subentries and config.match_subentry:
+        subentry_cache = SubentryCache()
+    print(f"Matching against {source}")
+    if count_only:
+        print("Counting all matches that can be uploaded")
+    matching_started = time.monotonic()
+    if merge:
+        # The plan and the uploads come in lemma order
+        action_counts, reason_counts, unmatched_lemmas, homographs = match_pairs(
+            merge_join(sort_lexemes_by_lemma(lexemes), saob_lemma_index), source,
+            uploader=uploader, plan_writer=plan_writer
+        )
+    elif processes > 1 and len(lexemes) > 1:
+        action_counts, reason_counts, unmatched_lemmas, homographs = match_in_parallel(
+            lexemes, saob_lemma_index, processes, source, uploader=uploader,
+            plan_writer=plan_writer
+        )
+    else:
+        action_counts, reason_counts, unmatched_lemmas, homographs = match_serially(
+            lexemes, saob_lemma_index, source, uploader=uploader, plan_writer=plan_writer
+        )
+    metrics.add_stage("matching", time.monotonic() - matching_started)
+    if homographs:
+        # Only download articles when uploading, planning and counting
+        # use the articles already in the store
+        for entry in rank_homographs(homographs, source, download=uploader is not None):
+            if entry.action != MatchAction.SKIP:
+                action_counts[MatchAction.SKIP] -= 1
+                action_counts[entry.action] += 1
+                reason_counts[plan.MULTIPLE_MATCHES] -= 1
+                reason_counts[entry.reason] += 1
+            if plan_writer is not None:
+                plan_writer.write(entry)
+            if uploader is not None and entry.action != MatchAction.SKIP:
+                uploader.submit(lexeme=entry.lexeme(), foreign_id=entry.foreign_id(source))
+    processed_count = sum(action_counts.values())
+    match_count = (reason_counts[plan.UNIQUE_MATCH] + reason_counts[plan.MULTIPLE_MATCHES]
+                   + reason_counts[plan.RANKED_MATCH])
+    skipped_multiple_matches = reason_counts[plan.MULTIPLE_MATCHES]
+    no_value_count = reason_counts[source.not_found_reason]
+    for action, count in action_counts.items():
+        metrics.increment(f"lexemes_{action.value}", count)
+    metrics.increment("lexemes_matched", match_count)
+    metrics.increment("lexemes_skipped_multiple_matches", skipped_multiple_matches)
+    metrics.increment("lexemes_ranked_matches", reason_counts[plan.RANKED_MATCH])
+    metrics.increment(f"lexemes_not_in_{source.name}", no_value_count)
+    if unmatched_lemmas and config.subentry_split_locally:
+        # Only look up the lemmas that look like compounds of SAOB lemmas
+        with metrics.stage("subentry_split"):
+            lookups = CompoundSplitter.from_index(saob_lemma_index).candidates(unmatched_lemmas)
+        print(f"{len(lookups)} of {len(set(unmatched_lemmas))} lemmas not found "
+              f"in the SAOB list look like compounds of SAOB lemmas")
+        metrics.increment("subentry_candidates", len(lookups))
+    else:
+        lookups = unmatched_lemmas
+    if lookups:
+        logger.info("Searching for the unmatched lemmas on saob.se to find subentries")
+        with metrics.stage("subentry_lookup"):
+            subentries = resolve_subentries(lookups, cache=subentry_cache)
+        for lemma in subentries:
+            logger.info(f"Found subentry match for {lemma}")
+            # Add new property (to be proposed) SAOB section ID
+            # TODO upload once new property is proposed and created
+        print(f"Found {len(subentries)} subentries for "
+              f"{len(set(unmatched_lemmas))} lemmas not found in the SAOB list")
     print(f"Processed {processed_count} lexemes. "
           f"Found {match_count} matches "
           f"out of which {skipped_multiple_matches} "
           f"was skipped because they had multiple entries "
           f"with the same lexical category. {no_value_count} "
-          f"entries with no main entry in SAOB was found")
+          f"entries with no main entry in {source.title} was found")
+    print(saob_category.report())
+    if subentry_cache is not None:
+        print(subentry_cache.report())
+        subentry_cache.close()
 
 
-def main():
-    if not count_only:
-        print("Logging in with Wikibase Integrator")
-        config.login_instance = wbi_login.Login(
-            user=config.username, pwd=config.password
+def fetch_glosses(lexeme_ids: Iterable[str], language_code: str = "sv") -> Dict[str, List[str]]:
+    """The glosses of the lexemes from the dump if one is
+    configured and from WDQS otherwise"""
+    if config.lexeme_dump is not None:
+        return LexemeDump(config.lexeme_dump).glosses(lexeme_ids, language_code=language_code)
+    return LexemeLanguage(language_code).fetch_glosses(lexeme_ids)
+
+
+def rank_homographs(entries: List[PlanEntry],
+                    source: DictionarySource,
+                    download: bool = False) -> List[PlanEntry]:
+    """Choose between the SAOB entries of lexemes skipped because of
+    multiple entries with the same category
+
+    The glosses of the senses of every lexeme are compared with the
+    articles of its candidates, see models/homograph_ranker.py. Articles
+    not in the article store are only downloaded with download, otherwise
+    lexemes without any stored article are left out. The ranked lexemes
+    are written with their scores to the review queue in
+    config.homograph_review_path which has the format of a match plan.
+    Those with a candidate that is clearly the most similar are written
+    as uploads of it so the queue can be applied once reviewed.
+
+    Until the thresholds are validated the entries keep being skipped.
+    With config.homograph_auto_add the clear candidates are added instead
+    and only the rest are written to the review queue."""
+    candidate_ids = list(dict.fromkeys(id for entry in entries for id in entry.candidates))
+    if not download and not os.path.exists(config.article_store_path):
+        print(f"Not ranking {len(entries)} lexemes with homographs because there "
+              f"is no article store, run get_saob_articles.py --homographs")
+        return entries
+    with metrics.stage("homograph_articles"), ArticleStore() as store:
+        if download:
+            saob.scrape_details((saob.SAOBEntry(id=id) for id in candidate_ids), store=store)
+        articles = {}
+        for id in candidate_ids:
+            page = store.get(id)
+            if page is not None:
+                articles[id] = saob.article_text(page)
+    # Positions in entries of the lexemes with at least one stored article
+    ranked = [index for index, entry in enumerate(entries)
+              if any(id in articles for id in entry.candidates)]
+    if len(ranked) < len(entries):
+        print(f"Not ranking {len(entries) - len(ranked)} lexemes with homographs "
+              f"because none of their articles are stored")
+    if not ranked:
+        return entries
+    with metrics.stage("homograph_glosses"):
+        glosses = fetch_glosses((entries[index].lexeme_id for index in ranked),
+                                language_code=source.language_code)
+    cases = [HomographCase(lexeme_id=entries[index].lexeme_id,
+                           gloss=" ".join(glosses.get(entries[index].lexeme_id, [])),
+                           candidates=entries[index].candidates)
+             for index in ranked]
+    with metrics.stage("homograph_ranking"):
+        HomographRanker().rank(cases, articles)
+    chosen = {}
+    review_count = 0
+    with MatchPlanWriter(config.homograph_review_path) as review_writer:
+        for index, case in zip(ranked, cases):
+            entry = entries[index]
+            entry.scores = [round(score, 4) for score in case.scores]
+            best = case.best()
+            if best is None:
+                review_writer.write(entry)
+                review_count += 1
+                continue
+            ranked_entry = PlanEntry(lexeme_id=entry.lexeme_id, lemma=entry.lemma,
+                                     lexical_category=entry.lexical_category,
+                                     action=MatchAction.ADD, saob_id=best,
+                                     reason=plan.RANKED_MATCH,
+                                     candidates=entry.candidates, scores=entry.scores,
+                                     property=entry.property, stated_in=entry.stated_in)
+            if config.homograph_auto_add:
+                chosen[index] = ranked_entry
+            else:
+                review_writer.write(ranked_entry)
+                review_count += 1
+    print(f"Ranked {len(ranked)} lexemes with homographs and found a clear "
+          f"entry for {sum(case.best() is not None for case in cases)} of them. "
+          f"{len(chosen)} were added and {review_count} were written to "
+          f"{config.homograph_review_path} for review")
+    return [chosen.get(index, entry) for index, entry in enumerate(entries)]
+
+
+def apply_plan(plan_path: str = None,
+               uploader: BatchUploader = None,
+               applied_ids: Set[str] = frozenset(),
+               shard: int = 0,
+               shards: int = 1):
+    """Stream the uploads in a match plan into the uploader
+
+    Lexemes in applied_ids are skipped so an interrupted apply can be
+    resumed and only lexemes with number % shards == shard are uploaded
+    so the plan can be split between several runs."""
+    if plan_path is None or uploader is None:
+        raise ValueError("Did not get the arguments needed")
+    submitted_count = 0
+    sources_by_property: Dict[str, DictionarySource] = {}
+    for entry in read_plan(plan_path):
+        if entry.action == MatchAction.SKIP:
+            continue
+        # Logs written before there were several sources only have the id
+        if entry.lexeme_id in applied_ids or f"{entry.lexeme_id}:{entry.property}" in applied_ids:
+            continue
+        if wikidata.EntityID(entry.lexeme_id).number % shards != shard:
+            continue
+        source = sources_by_property.get(entry.property)
+        if source is None:
+            source = sources_by_property[entry.property] = source_for_property(entry.property)
+        uploader.submit(lexeme=entry.lexeme(), foreign_id=entry.foreign_id(source))
+        submitted_count += 1
+    print(f"Submitted {submitted_count} uploads from {plan_path}")
+
+
+def preflight(uploader: BatchUploader):
+    """Put the pre-flight check in front of the uploader if it is enabled"""
+    if config.preflight:
+        return Preflight(uploader)
+    return nullcontext(uploader)
+
+
+def login():
+    print("Logging in with Wikibase Integrator")
+    config.login_instance = wbi_login.Login(
+        user=config.username, pwd=config.password
+    )
+    # Set User-Agent
+    wbi_config.config["USER_AGENT_DEFAULT"] = f"LexSAOB (WikidataIntegrator/0.11.0) User:So9q"
+    # Edits are refused while the replicas lag more than this
+    wbi_config.config["MAXLAG"] = config.maxlag
+
+
+def fetch_lexemes(language_code: str = "sv",
+                  properties: List[str] = ("P8478",),
+                  stream: bool = False) -> Iterable[wikidata.Lexeme]:
+    """All lexemes in the language that lack at least one of the properties.
+    Every lexeme is kept even if another one has the same lemma
+
+    With stream and in merge join mode lexemes from a dump are streamed
+    straight into the sort instead of being read into a list first"""
+    language = LexemeLanguage(language_code)
+    properties = list(properties)
+    if stream and config.merge_join and config.lexeme_dump is not None:
+        return LexemeDump(config.lexeme_dump).lexemes_without_properties(
+            language_qid=language.language_qid.value,
+            properties=properties
         )
-        # Set User-Agent
-        wbi_config.config["USER_AGENT_DEFAULT"] = f"LexSAOB (WikidataIntegrator/0.11.0) User:So9q"
-    language = LexemeLanguage("sv")
-    language.fetch_all_lexemes_without_saob_id()
-    lexemes_list = language.lemma_list()
-    lexemes_data = language.data_dictionary_with_lemma_as_key()
-    saob_list, saob_data = load_saob_into_memory()
-    process_lexemes(lexeme_lemma_list=lexemes_list, lexemes_data=lexemes_data, saob_lemma_list=saob_list,
-                    saob_data=saob_data)
+    with metrics.stage("fetch_lexemes"):
+        if config.lexeme_dump is not None:
+            language.fetch_all_lexemes_without_properties_from_dump(
+                LexemeDump(config.lexeme_dump), properties
+            )
+        else:
+            language.fetch_all_lexemes_without_properties(properties)
+    return language.lexemes
+
+
+def match_sources(sources: List[DictionarySource] = None,
+                  uploader: BatchUploader = None,
+                  plan_writer: MatchPlanWriter = None):
+    """Match the lexemes against every enabled dictionary source
+
+    The lexemes of a language are fetched once for all sources of the
+    language with the properties each of them lacks, and every source
+    then matches the lexemes that lack its property. A lexeme dump is
+    only streamed when there is a single source."""
+    if sources is None:
+        sources = enabled_sources()
+    sources_by_language: Dict[str, List[DictionarySource]] = {}
+    for source in sources:
+        sources_by_language.setdefault(source.language_code, []).append(source)
+    for language_code, language_sources in sources_by_language.items():
+        print(f"Fetching the lexemes for {', '.join(str(source) for source in language_sources)}")
+        lexemes = fetch_lexemes(language_code=language_code,
+                                properties=[source.property for source in language_sources],
+                                stream=len(language_sources) == 1)
+        for source in language_sources:
+            process_lexemes(lexemes=lexemes, saob_lemma_index=source.load_index(),
+                            uploader=uploader, plan_writer=plan_writer, source=source)
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse I/N of --shard, argparse shows the error with the usage"""
+    try:
+        shard, shards = (int(number) for number in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not of the form I/N, e.g. 0/2")
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"{value} is not a shard, I must be "
+                                         "at least 0 and less than N")
+    return shard, shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add SAOB and other dictionary identifiers to lexemes")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="match and upload in one go (default)")
+    plan_parser = subparsers.add_parser("plan", help="match without uploading "
+                                                     "and write a match plan")
+    plan_parser.add_argument("plan", help="JSON lines file to write")
+    apply_parser = subparsers.add_parser("apply", help="upload the edits in a match plan")
+    apply_parser.add_argument("plan", help="JSON lines file written by plan")
+    apply_parser.add_argument("--shard", default=(0, 1), type=parse_shard,
+                              help="only apply lexemes with number %% N == I given as I/N")
+    args = parser.parse_args()
+    if config.metrics_interval:
+        metrics.start_export(config.metrics_interval,
+                             json_path=config.metrics_json,
+                             prometheus_path=config.metrics_prometheus)
+    try:
+        run_command(args)
+    finally:
+        metrics.stop()
+        metrics.write(json_path=config.metrics_json,
+                      prometheus_path=config.metrics_prometheus)
+        print(f"Wrote the metrics to {config.metrics_json} and {config.metrics_prometheus}")
+
+
+def run_command(args: argparse.Namespace):
+    if args.command == "plan":
+        with MatchPlanWriter(args.plan) as plan_writer:
+            match_sources(plan_writer=plan_writer)
+        print(f"Wrote the match plan to {args.plan}")
+    elif args.command == "apply":
+        shard, shards = args.shard
+        # Lexemes uploaded by earlier runs of this plan are logged here
+        applied_path = f"{args.plan}.applied"
+        applied_ids = set()
+        if os.path.exists(applied_path):
+            with open(applied_path) as file:
+                applied_ids = set(file.read().split())
+            print(f"Skipping {len(applied_ids)} lexemes already applied")
+        login()
+        with open(applied_path, "a") as applied_log:
+            lock = threading.Lock()
+
+            def log_applied(lexeme: wikidata.Lexeme, foreign_id: ForeignID):
+                with lock:
+                    applied_log.write(f"{lexeme.id}:{foreign_id.property}\n")
+                    applied_log.flush()
+
+            with metrics.stage("upload"), BatchUploader(on_success=log_applied) as uploader:
+                with preflight(uploader) as checked_uploader:
+                    apply_plan(plan_path=args.plan, uploader=checked_uploader,
+                               applied_ids=applied_ids, shard=shard, shards=shards)
+    else:
+        if not count_only:
+            login()
+        if count_only:
+            match_sources()
+        else:
+            # Uploads run in the background while we match
+            with metrics.stage("match_and_upload"), BatchUploader() as uploader:
+                with preflight(uploader) as checked_uploader:
+                    match_sources(uploader=checked_uploader)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+import hashlib
+import sqlite3
+import time
+import zlib
+from typing import Iterator, Union
+
+import config
+
+
+class ArticleStore:
+    """Local store of SAOB article pages keyed by entry id
+
+    Pages are stored compressed with zlib under the SHA-256 of the page
+    so a page that is fetched again unchanged or shared by several ids
+    is only stored once. The index maps the entry id to the digest of
+    its page and when it was fetched. Both are tables in one SQLite file
+    which is faster than one file per page for blobs this small. A page
+is deleted when no id refers to it any more.
+
+    Reading a page is one indexed lookup and a decompression so analyses
+    can read article text from disk instead of downloading it."""
+    path: str
+    compression_level: int = 6
+
+    def __init__(self, path: str = None):
+        self.path = path or config.article_store_path
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "digest BLOB PRIMARY KEY, "
+            "data BLOB NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "id TEXT PRIMARY KEY, "
+            "digest BLOB NOT NULL REFERENCES pages (digest), "
+            "fetched_at REAL NOT NULL)"
+        )
+        # Finds whether a page is still used when an article is refetched
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS articles_digest ON articles (digest)"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, id: str):
+        return self.connection.execute(
+            "SELECT 1 FROM articles WHERE id = ?", (id,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def put(self, id: str, page: Union[bytes, str]) -> bytes:
+        """Store the page of the entry and return its digest. The page
+        it had before is deleted in the same transaction if no other
+        entry has it"""
+        if isinstance(page, str):
+            page = page.encode("utf-8")
+        digest = hashlib.sha256(page).digest()
+        previous = self.connection.execute(
+            "SELECT digest FROM articles WHERE id = ?", (id,)
+        ).fetchone()
+        self.connection.execute(
+            "INSERT OR IGNORE INTO pages VALUES (?, ?)",
+            (digest, zlib.compress(page, self.compression_level))
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO articles VALUES (?, ?, ?)",
+            (id, digest, time.time())
+        )
+        if previous is not None and previous[0] != digest:
+            self.connection.execute(
+                "DELETE FROM pages WHERE digest = ? "
+                "AND NOT EXISTS (SELECT 1 FROM articles WHERE digest = ?)",
+                (previous[0], previous[0])
+            )
+        return digest
+
+    def get(self, id: str, default=None) -> str:
+        """The page of the entry or default if it is not stored"""
+        row = self.connection.execute(
+            "SELECT data FROM articles JOIN pages USING (digest) WHERE id = ?", (id,)
+        ).fetchone()
+        if row is None:
+            return default
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def ids(self) -> Iterator[str]:
+        for row in self.connection.execute("SELECT id FROM articles ORDER BY id"):
+            yield row[0]
+
+    def commit(self):
+        self.connection.commit()
+
+    def vacuum(self) -> int:
+        """Delete the pages no entry has, e.g. left by stores written
+        before put() deleted them, and shrink the file. Returns the
+        number of pages deleted"""
+        deleted = self.connection.execute(
+            "DELETE FROM pages WHERE digest NOT IN (SELECT digest FROM articles)"
+        ).rowcount
+        self.connection.commit()
+        self.connection.execute("VACUUM")
+        return deleted
+
+    def __str__(self):
+        pages, compressed = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM pages"
+        ).fetchone()
+        return (f"Article store {self.path} with {len(self)} articles in "
+                f"{pages} distinct pages, {round(compressed / 2 ** 20, 1)} MiB compressed")
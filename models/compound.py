@@ -0,0 +1,101 @@
+import logging
+from typing import Iterable, List, FrozenSet
+
+# Swedish compounds often join the head and the tail with an s
+# e.g. arbetsdag = arbete + dag or drop the last vowel of the head
+# e.g. skolbok = skola + bok
+linking_letters = ("s",)
+dropped_vowels = ("a", "e", "o")
+
+
+class CompoundSplit:
+    """A proposed split of a lemma into a head lemma and a tail
+    e.g. handuk -> hand + duk"""
+    lemma: str
+    head: str
+    linking: str
+    tail: str
+
+    def __init__(self, lemma: str, head: str, linking: str, tail: str):
+        self.lemma = lemma
+        self.head = head
+        self.linking = linking
+        self.tail = tail
+
+    def __str__(self):
+        return f"CompoundSplit: {self.lemma} = {self.head} + {self.linking}-{self.tail}"
+
+    def __eq__(self, other):
+        return (isinstance(other, CompoundSplit) and
+                (self.lemma, self.head, self.linking, self.tail) ==
+                (other.lemma, other.head, other.linking, other.tail))
+
+
+class CompoundSplitter:
+    """Propose head/tail splits of lemmas that are not in the SAOB list
+
+    SAOB lists many compounds as subentries of the head entry, e.g. handuk
+    is found under "hand" as "-duk" (see models.saob.SAOBSubentry). A split
+    is proposed when the head is a SAOB lemma and the tail is a SAOB lemma
+    or suffix too. Only lemmas with a split are worth looking up on saob.se.
+
+    Every prefix of a lemma is looked up in a set of the SAOB lemmas. That
+    is as fast as walking a trie but a small fraction of its memory."""
+    lemmas: FrozenSet[str]
+    min_head: int
+    min_tail: int
+
+    def __init__(self, lemmas: Iterable[str], min_head: int = 2, min_tail: int = 2):
+        self.lemmas = frozenset(lemmas)
+        self.min_head = min_head
+        self.min_tail = min_tail
+
+    @classmethod
+    def from_index(cls, saob_lemma_index, **kwargs):
+        """Build from a lemma index or a models.saob_snapshot.SAOBSnapshot"""
+        if hasattr(saob_lemma_index, "lemmas"):
+            return cls(saob_lemma_index.lemmas(), **kwargs)
+        return cls(saob_lemma_index.keys(), **kwargs)
+
+    def is_head(self, prefix: str) -> str:
+        """The SAOB lemma that prefix is the head form of or None"""
+        if prefix in self.lemmas:
+            return prefix
+        for vowel in dropped_vowels:
+            if prefix + vowel in self.lemmas:
+                return prefix + vowel
+        return None
+
+    def is_tail(self, tail: str) -> bool:
+        return tail in self.lemmas or f"-{tail}" in self.lemmas
+
+    def splits(self, lemma: str) -> List[CompoundSplit]:
+        """All splits of the lemma, the longest head first"""
+        splits = []
+        for end in range(len(lemma) - self.min_tail, self.min_head - 1, -1):
+            head = self.is_head(lemma[:end])
+            if head is None:
+                continue
+            tail = lemma[end:]
+            if self.is_tail(tail):
+                splits.append(CompoundSplit(lemma, head, "", tail))
+            elif self.is_tail(lemma[end - 1] + tail):
+                # The letter shared by the head and the tail is
+                # written once e.g. handuk = hand + duk
+                splits.append(CompoundSplit(lemma, head, "", lemma[end - 1] + tail))
+            for linking in linking_letters:
+                if (tail.startswith(linking) and len(tail) - len(linking) >= self.min_tail
+                        and self.is_tail(tail[len(linking):])):
+                    splits.append(CompoundSplit(lemma, head, linking, tail[len(linking):]))
+        return splits
+
+    def candidates(self, lemmas: Iterable[str]) -> List[str]:
+        """The distinct lemmas that have at least one split"""
+        logger = logging.getLogger(__name__)
+        candidates = []
+        for lemma in dict.fromkeys(lemmas):
+            splits = self.splits(lemma)
+            if splits:
+                logger.debug(f"{lemma} could be a subentry: {splits[0]}")
+                candidates.append(lemma)
+        return candidates
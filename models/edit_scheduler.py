@@ -0,0 +1,168 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+import requests
+
+import config
+from models.http_client import retry_after_seconds
+from models.metrics import metrics
+
+
+class Throttled(Exception):
+    """The API asked us to slow down because of replication lag (maxlag),
+    because we hit a rate limit or because it is overloaded, read-only or
+    could not be reached. retry_after and lag are in seconds if known"""
+    retry_after: float
+    lag: float
+    rate_limited: bool
+
+    def __init__(self, message: str, retry_after: float = None, lag: float = None,
+                 rate_limited: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.lag = lag
+        self.rate_limited = rate_limited
+
+
+def throttled_from_response(response: requests.Response) -> Throttled:
+    """Return a Throttled if the response to an edit means that we should
+    slow down and try again and None otherwise
+
+    MediaWiki answers 429 when rate limited and 503 when overloaded, and
+    otherwise 200 with an error code: maxlag with the lag, readonly, or
+    ratelimited or the message actionthrottledtext for rate limits. The
+    pause is Retry-After if sent and otherwise the lag if known."""
+    retry_after = retry_after_seconds(response)
+    if response.status_code == 429:
+        return Throttled("Got 429 Too Many Requests", retry_after=retry_after, rate_limited=True)
+    if response.status_code in (502, 503, 504):
+        return Throttled(f"Got {response.status_code} from the API", retry_after=retry_after)
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    api_error = data.get("error") if isinstance(data, dict) else None
+    if not isinstance(api_error, dict):
+        return None
+    code = api_error.get("code")
+    messages = {message.get("name") for message in api_error.get("messages", [])}
+    if code == "maxlag":
+        lag = api_error.get("lag")
+        return Throttled(f"Replication lag is {lag}s",
+                         retry_after=retry_after if retry_after is not None else lag, lag=lag)
+    if code in ("ratelimited", "actionthrottled") or "actionthrottledtext" in messages:
+        return Throttled(f"Rate limited: {api_error.get('info', code)}",
+                         retry_after=retry_after, rate_limited=True)
+    if code == "readonly":
+        return Throttled(f"The wiki is read-only: {api_error.get('info', code)}",
+                         retry_after=retry_after)
+    return None
+
+
+class EditScheduler:
+    """Schedule edits at the highest rate the API accepts
+
+    Edits are spread evenly at the current rate which starts at and never
+    exceeds edits_per_minute. When the API throttles an edit all threads
+    pause, for Retry-After if given and otherwise with exponential backoff
+    that is at least the replication lag.
+
+    Lag is temporary so the rate is halved and then quickly raised back
+    to where it was. Hitting the rate limit means the rate was too high so
+    the limit is remembered as 90% of the rate. The rate then stays at the
+    limit and only slowly probes above it, instead of bursting up and
+    getting throttled again. A throttle that happens during a pause only
+    extends it so several threads hitting the same spike count once."""
+    ceiling: float
+    floor: float
+    limit: float
+    rate: float
+    next_slot: float
+    paused_until: float
+    max_retries: int
+
+    def __init__(self,
+                 edits_per_minute: float = None,
+                 min_edits_per_minute: float = None,
+                 max_retries: int = None,
+                 base_delay: float = None,
+                 max_delay: float = None):
+        self.ceiling = edits_per_minute or config.edits_per_minute
+        if self.ceiling <= 0:
+            raise ValueError("edits_per_minute has to be a positive number")
+        self.floor = min(min_edits_per_minute or config.min_edits_per_minute, self.ceiling)
+        self.max_retries = config.edit_max_retries if max_retries is None else max_retries
+        self.base_delay = base_delay or config.edit_backoff_base
+        self.max_delay = max_delay or config.edit_backoff_max
+        self.limit = self.ceiling
+        self.rate = self.ceiling
+        self.next_slot = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Sleep until the next edit may start"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, self.paused_until, now)
+            self.next_slot = slot + 60 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.limit:
+                # Back to the limit after roughly 20 successful edits
+                self.rate = min(self.limit, self.rate + self.limit / 20)
+            else:
+                # Probe for a higher limit, 1% per 10 edits
+                self.limit = self.rate = min(self.ceiling, self.rate * 1.001)
+
+    def throttled(self, error: Throttled, attempt: int) -> float:
+        """Pause all edits and lower the rate. Returns the pause in seconds"""
+        logger = logging.getLogger(__name__)
+        if error.retry_after is not None:
+            delay = error.retry_after
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            if error.lag is not None:
+                delay = max(delay, error.lag)
+            # Jitter so the threads do not come back at the same time
+            delay *= random.uniform(1, 1.25)
+        with self.lock:
+            now = time.monotonic()
+            if self.paused_until <= now:
+                if error.rate_limited:
+                    self.limit = self.rate = max(self.floor, self.rate * 0.9)
+                else:
+                    self.rate = max(self.floor, self.rate / 2)
+            self.paused_until = max(self.paused_until, now + delay)
+            self.next_slot = max(self.next_slot, self.paused_until)
+        logger.warning(f"{error}, pausing edits for {round(delay, 1)}s "
+                       f"and lowering the rate to {round(self.rate, 1)} edits per minute")
+        metrics.increment("edits_throttled")
+        metrics.increment("edit_pause_seconds", delay)
+        return delay
+
+    def run(self, edit: Callable):
+        """Run edit() when it is its turn, retrying it when it raises
+        Throttled up to max_retries times"""
+        attempt = 0
+        while True:
+            with metrics.stage("upload_rate_limit_wait"):
+                self.wait()
+            try:
+                result = edit()
+            except Throttled as e:
+                error = e
+            else:
+                self.succeeded()
+                return result
+            # The other threads pause too even if we give up
+            self.throttled(error, attempt)
+            if attempt >= self.max_retries:
+                raise error
+            attempt += 1
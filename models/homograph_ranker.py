@@ -0,0 +1,125 @@
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import config
+
+word_pattern = re.compile(r"[^\W\d_]{2,}")
+
+
+def tokenize(text: str) -> List[str]:
+    return word_pattern.findall(text.lower())
+
+
+class HomographCase:
+    """A lexeme and the SAOB entries with its lemma and lexical category"""
+    lexeme_id: str
+    gloss: str
+    candidates: List[str]  # SAOB ids
+    scores: List[float]
+
+    def __init__(self, lexeme_id: str, gloss: str, candidates: List[str]):
+        self.lexeme_id = lexeme_id
+        self.gloss = gloss
+        self.candidates = candidates
+        self.scores = [0.0] * len(candidates)
+
+    def best(self, min_score: float = None, margin: float = None) -> str:
+        """The SAOB id of the best candidate if it scores at least min_score
+        and at least margin more than the second best, otherwise None"""
+        if min_score is None:
+            min_score = config.homograph_min_score
+        if margin is None:
+            margin = config.homograph_margin
+        ranked = sorted(zip(self.scores, self.candidates), reverse=True)
+        best_score, best_id = ranked[0]
+        second_score = ranked[1][0] if len(ranked) > 1 else 0.0
+        if best_score >= min_score and best_score - second_score >= margin:
+            return best_id
+        return None
+
+
+class HomographRanker:
+    """Score SAOB homographs against the senses of a lexeme
+
+    Every case is a lexeme with its Swedish glosses joined to one text and
+    the entries it could be. Glosses and article texts are weighted with
+    TF-IDF where the document frequencies are counted over all of them and
+    every candidate gets the cosine similarity between the glosses and
+    its article.
+
+    Words are numbered once and every text is kept as an array of word
+    numbers and counts. The cases are then scored batch_size at a time:
+    only words in the glosses of the batch can contribute to a dot product
+    so the matrices of the batch have one column per such word and all
+    the similarities of the batch are one matrix product. The norms of the
+    articles are computed over all their words beforehand."""
+    batch_size: int
+
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or config.homograph_batch_size
+        self.vocabulary: Dict[str, int] = {}
+
+    def encode(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Word numbers and counts of the text"""
+        counts = Counter(tokenize(text))
+        words = np.fromiter((self.vocabulary.setdefault(word, len(self.vocabulary))
+                             for word in counts), dtype=np.int64, count=len(counts))
+        return words, np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    def rank(self, cases: List[HomographCase], articles: Dict[str, str]):
+        """Set the scores of the cases. articles is the text of every
+        candidate by SAOB id, candidates without one score 0"""
+        logger = logging.getLogger(__name__)
+        glosses = [self.encode(case.gloss) for case in cases]
+        article_ids = list(articles)
+        article_rows = {id: row for row, id in enumerate(article_ids)}
+        encoded_articles = [self.encode(articles[id]) for id in article_ids]
+        # Smoothed IDF like in scikit-learn
+        document_frequency = np.zeros(len(self.vocabulary))
+        for words, counts in glosses + encoded_articles:
+            document_frequency[words] += 1
+        documents_count = len(glosses) + len(encoded_articles)
+        idf = np.log((1 + documents_count) / (1 + document_frequency)) + 1
+        article_norms = np.array([np.linalg.norm(counts * idf[words])
+                                  for words, counts in encoded_articles])
+        logger.info(f"Ranking {len(cases)} homograph cases against {len(article_ids)} "
+                    f"articles with {len(self.vocabulary)} distinct words")
+        for start in range(0, len(cases), self.batch_size):
+            batch = range(start, min(start + self.batch_size, len(cases)))
+            columns = np.unique(np.concatenate([glosses[index][0] for index in batch]))
+            if len(columns) == 0:
+                continue
+            queries = np.zeros((len(batch), len(columns)))
+            for row, index in enumerate(batch):
+                words, counts = glosses[index]
+                queries[row, np.searchsorted(columns, words)] = counts * idf[words]
+            norms = np.linalg.norm(queries, axis=1)
+            norms[norms == 0] = 1
+            queries /= norms[:, None]
+            rows = sorted({article_rows[id] for index in batch
+                           for id in cases[index].candidates if id in article_rows})
+            if not rows:
+                continue
+            candidates = np.zeros((len(rows), len(columns)))
+            for row, article_row in enumerate(rows):
+                words, counts = encoded_articles[article_row]
+                positions = np.searchsorted(columns, words).clip(max=len(columns) - 1)
+                found = columns[positions] == words
+                candidates[row, positions[found]] = counts[found] * idf[words[found]]
+            norms = article_norms[rows]
+            norms[norms == 0] = 1
+            candidates /= norms[:, None]
+            # Cosine similarity of every case in the batch with every article in it
+            similarities = queries @ candidates.T
+            candidate_columns = {article_row: column for column, article_row in enumerate(rows)}
+            for row, index in enumerate(batch):
+                case = cases[index]
+                case.scores = [
+                    float(similarities[row, candidate_columns[article_rows[id]]])
+                    if id in article_rows else 0.0
+                    for id in case.candidates
+                ]
@@ -0,0 +1,155 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from models.metrics import metrics
+
+user_agent = "LexSAOB (https://github.com/dpriskorn/LexSAOB) User:So9q"
+sparql_endpoint = "https://query.wikidata.org/sparql"
+# Worth retrying, the request did not do anything
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+def retry_after_seconds(response: requests.Response) -> float:
+    """The seconds in the Retry-After header of the response if any"""
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return float(response.headers["Retry-After"])
+    return None
+
+
+class HTTPClient:
+    """One keep-alive session shared by the crawler, the subentry lookups,
+    the SPARQL queries, the pre-flight checks and the edits
+
+    - connections are pooled per host so TLS handshakes are reused
+    - responses are compressed
+    - every request has a connect and read timeout so a hung socket
+      cannot freeze a crawl
+    - connection errors, timeouts and 429 and 5xx responses are retried
+      with exponential backoff and jitter, honouring Retry-After
+    - at most per_host_concurrency requests to the same host at a time
+    - requests, errors, latency and bytes are counted per host in
+      models.metrics
+
+    get() and post() take the same arguments as in requests and
+    max_retries. The edits are sent with max_retries=0 because
+    models/edit_scheduler.py retries them. Use the shared instance from
+    shared_client()."""
+    timeout: tuple
+    max_retries: int
+    per_host_concurrency: int
+    session: requests.Session
+
+    def __init__(self,
+                 timeout: float = None,
+                 max_retries: int = None,
+                 per_host_concurrency: int = None,
+                 backoff: float = None):
+        self.timeout = (config.http_connect_timeout, timeout or config.http_timeout)
+        self.max_retries = config.http_max_retries if max_retries is None else max_retries
+        self.per_host_concurrency = per_host_concurrency or config.http_per_host_concurrency
+        self.backoff = backoff or config.http_backoff
+        self.session = requests.Session()
+        # Enough pooled connections for every request that may run at once
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.per_host_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept-Encoding": "gzip, deflate",
+        })
+        self.host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def host_limit(self, host: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            limit = self.host_limits.get(host)
+            if limit is None:
+                limit = self.host_limits[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return limit
+
+    def delay(self, attempt: int, response: requests.Response = None) -> float:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return retry_after
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def request(self, method: str, url: str, max_retries: int = None, **kwargs) -> requests.Response:
+        """Make the request retrying up to max_retries times, by default
+        the max_retries of the client. The response of the last try is
+        returned even if its status is not ok and the exception of the
+        last try is raised"""
+        logger = logging.getLogger(__name__)
+        if max_retries is None:
+            max_retries = self.max_retries
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).hostname or ""
+        name = "http_" + host.replace(".", "_").replace("-", "_")
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with self.host_limit(host), metrics.request(name):
+                    response = self.session.request(method, url, **kwargs)
+                    metrics.increment(f"{name}_bytes", len(response.content))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries:
+                    raise
+                problem = e
+            else:
+                if response.status_code not in retry_statuses or attempt >= max_retries:
+                    return response
+                problem = f"status {response.status_code}"
+            delay = self.delay(attempt, response)
+            logger.warning(f"Got {problem} from {host}, retrying in {round(delay, 1)}s")
+            metrics.increment(f"{name}_retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def sparql(self, query: str) -> dict:
+        """Run a query on WDQS and return the JSON results"""
+        response = self.post(sparql_endpoint, data={"query": query},
+                             headers={"Accept": "application/sparql-results+json"})
+        response.raise_for_status()
+        return response.json()
+
+
+client: HTTPClient = None
+client_lock = threading.Lock()
+
+
+def shared_client() -> HTTPClient:
+    """The HTTPClient shared by everything in this process"""
+    global client
+    with client_lock:
+        if client is None:
+            client = HTTPClient()
+        return client
+
+
+def execute_sparql_query(query: str) -> dict:
+    """Same as wikibaseintegrator.wbi_functions.execute_sparql_query()
+    but over the shared client"""
+    return shared_client().sparql(query)
@@ -0,0 +1,93 @@
+import bz2
+import gzip
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, TextIO
+
+from models.wikidata import Lexeme
+
+
+class LexemeDump:
+    """Stream lexemes from a Wikidata lexeme JSON dump like
+    https://dumps.wikimedia.org/wikidatawiki/entities/latest-lexemes.json.gz
+
+    The dump is one big JSON array with one entity per line so it is
+    read one line at a time and never held in memory."""
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def open(self) -> TextIO:
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "rt", encoding="utf-8")
+        elif self.path.endswith(".bz2"):
+            return bz2.open(self.path, "rt", encoding="utf-8")
+        else:
+            return open(self.path, "rt", encoding="utf-8")
+
+    def lines(self, needle: str = None) -> Iterator[str]:
+        """Lines with one entity each. If a needle is given only lines
+        containing it are returned, which is much cheaper than parsing"""
+        with self.open() as file:
+            for line in file:
+                if needle is not None and needle not in line:
+                    continue
+                line = line.strip().rstrip(",")
+                if line in ("", "[", "]"):
+                    continue
+                yield line
+
+    def entities(self) -> Iterator[dict]:
+        for line in self.lines():
+            yield json.loads(line)
+
+    def lexemes_without_properties(self,
+                                   language_qid: str = None,
+                                   properties: List[str] = None) -> Iterator[Lexeme]:
+        """Yield a Lexeme for every lemma of the lexemes in the language
+        that have no statement, not even a novalue one, with at least one
+        of the properties. This is the same as the query in
+        LexemeLanguage.fetch_all_lexemes_without_properties()"""
+        logger = logging.getLogger(__name__)
+        if language_qid is None or not properties:
+            raise ValueError("Did not get the arguments needed")
+        count = 0
+        for line in self.lines(needle=f'"{language_qid}"'):
+            entity = json.loads(line)
+            if entity.get("language") != language_qid:
+                continue
+            claims = entity.get("claims", {})
+            # Deprecated statements are not truthy so WDQS ignores them too
+            missing_properties = {property for property in properties
+                                  if not any(statement.get("rank") != "deprecated"
+                                             for statement in claims.get(property, []))}
+            if not missing_properties:
+                continue
+            for lemma in entity["lemmas"].values():
+                count += 1
+                yield Lexeme(
+                    id=entity["id"],
+                    lemma=lemma["value"],
+                    lexical_category=entity["lexicalCategory"],
+                    missing_properties=missing_properties
+                )
+        logger.info(f"Found {count} lexemes without any of {', '.join(properties)} in {self.path}")
+
+    def glosses(self,
+                lexeme_ids: Iterable[str] = None,
+                language_code: str = None) -> Dict[str, List[str]]:
+        """Same as LexemeLanguage.fetch_glosses() but read from the dump"""
+        if lexeme_ids is None or language_code is None:
+            raise ValueError("Did not get the arguments needed")
+        lexeme_ids = set(lexeme_ids)
+        glosses = {}
+        for line in self.lines(needle='"senses"'):
+            entity = json.loads(line)
+            if entity.get("id") not in lexeme_ids:
+                continue
+            for sense in entity.get("senses", []):
+                gloss = sense.get("glosses", {}).get(language_code)
+                if gloss is not None:
+                    glosses.setdefault(entity["id"], []).append(gloss["value"])
+        return glosses
@@ -0,0 +1,96 @@
+import heapq
+import json
+import logging
+import tempfile
+from typing import Iterable, Iterator, List, Tuple, TextIO
+
+import config
+from models.saob import SAOBLemmaGroup
+from models.saob_snapshot import SAOBSnapshot
+from models.wikidata import Lexeme
+
+
+def lemma_key(lexeme: Lexeme) -> str:
+    # Comparing str compares code points which is the same order as the
+    # utf-8 bytes the snapshot is sorted by
+    return lexeme.lemma
+
+
+def write_run(lexemes: List[Lexeme]) -> TextIO:
+    """Spill a sorted run of lexemes to a temporary file"""
+    file = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for lexeme in lexemes:
+        missing_properties = lexeme.missing_properties
+        if missing_properties is not None:
+            missing_properties = sorted(missing_properties)
+        file.write(json.dumps([lexeme.id, lexeme.lemma, lexeme.lexical_category,
+                               missing_properties], ensure_ascii=False) + "\n")
+    file.seek(0)
+    return file
+
+
+def read_run(file: TextIO) -> Iterator[Lexeme]:
+    for line in file:
+        id, lemma, lexical_category, missing_properties = json.loads(line)
+        if missing_properties is not None:
+            missing_properties = set(missing_properties)
+        yield Lexeme(id=id, lemma=lemma, lexical_category=lexical_category,
+                     missing_properties=missing_properties)
+
+
+def sort_lexemes_by_lemma(lexemes: Iterable[Lexeme], run_size: int = None) -> Iterator[Lexeme]:
+    """Sort the lexemes by lemma holding at most run_size of them in memory
+
+    The lexemes are read in runs that are sorted and spilled to temporary
+    files, which are then merged. Lexemes with the same lemma keep their
+    order."""
+    logger = logging.getLogger(__name__)
+    if run_size is None:
+        run_size = config.merge_join_run_size
+    runs = []
+    run = []
+    try:
+        for lexeme in lexemes:
+            run.append(lexeme)
+            if len(run) == run_size:
+                run.sort(key=lemma_key)
+                runs.append(write_run(run))
+                run = []
+        run.sort(key=lemma_key)
+        if not runs:
+            # Everything fit in one run so nothing has to be merged
+            yield from run
+            return
+        runs.append(write_run(run))
+        run = []
+        logger.info(f"Merging {len(runs)} sorted runs of lexemes")
+        yield from heapq.merge(*[read_run(file) for file in runs], key=lemma_key)
+    finally:
+        for file in runs:
+            file.close()
+
+
+def merge_join(lexemes: Iterable[Lexeme],
+               snapshot: SAOBSnapshot) -> Iterator[Tuple[Lexeme, SAOBLemmaGroup]]:
+    """Yield every lexeme with the SAOB lemma group of its lemma or None
+
+    The lexemes have to be sorted by lemma, see sort_lexemes_by_lemma().
+    Both sides are walked once in lemma order so only the current group is
+    held in memory. Lexemes with the same lemma get the same group."""
+    lemmas = enumerate(snapshot.lemmas())
+    index, lemma = next(lemmas, (None, None))
+    group = None
+    previous_lemma = None
+    for lexeme in lexemes:
+        if previous_lemma is not None and lexeme.lemma < previous_lemma:
+            raise Exception(f"The lexemes are not sorted by lemma, "
+                            f"{lexeme.lemma} came after {previous_lemma}")
+        previous_lemma = lexeme.lemma
+        while lemma is not None and lemma < lexeme.lemma:
+            index, lemma = next(lemmas, (None, None))
+        if lemma == lexeme.lemma:
+            if group is None or group.lemma != lemma:
+                group = snapshot.group(index)
+            yield lexeme, group
+        else:
+            yield lexeme, None
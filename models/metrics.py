@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Upper bounds in seconds, the same as the default of the Prometheus clients
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Counts observations in cumulative buckets like a Prometheus histogram"""
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    count: int
+    sum: float
+
+    def __init__(self, buckets: Tuple[float, ...] = default_buckets):
+        self.buckets = buckets
+        # The last count is for observations above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[int]:
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"],
+                                self.cumulative_counts())),
+        }
+
+
+class Metrics:
+    """Stage timers, counters and latency histograms of a run
+
+    Everything is kept in memory and guarded by one lock so it can be
+    updated from the upload and lookup threads. Use the shared instance
+    `metrics` below and export it with write() at the end of the run or
+    every interval seconds with start_export()."""
+    prefix = "lexsaob"
+    started: float
+    counters: Dict[str, float]
+    stages: Dict[str, float]
+    histograms: Dict[str, Histogram]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.export_thread: threading.Thread = None
+        self.stop_export = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.stages = {}
+            self.histograms = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def add_stage(self, name: str, seconds: float):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage of the run. Stages that run more than once add up"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.monotonic() - start)
+
+    @contextmanager
+    def request(self, name: str):
+        """Count a request and observe its latency in the histogram
+        <name>_seconds. Requests that raise are counted as <name>_errors"""
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.increment(f"{name}_errors")
+            raise
+        finally:
+            self.increment(f"{name}_requests")
+            self.observe(f"{name}_seconds", time.monotonic() - start)
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "started": self.started,
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.to_dict()
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format, e.g. for
+        the textfile collector of the node exporter"""
+        data = self.to_dict()
+        lines = [f"# TYPE {self.prefix}_elapsed_seconds gauge",
+                 f"{self.prefix}_elapsed_seconds {data['elapsed_seconds']}",
+                 f"# TYPE {self.prefix}_stage_seconds gauge"]
+        for name, seconds in sorted(data["stages"].items()):
+            lines.append(f'{self.prefix}_stage_seconds{{stage="{name}"}} {seconds}')
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        for name, histogram in sorted(data["histograms"].items()):
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for bucket, count in histogram["buckets"].items():
+                lines.append(f'{self.prefix}_{name}_bucket{{le="{bucket}"}} {count}')
+            lines.append(f"{self.prefix}_{name}_sum {histogram['sum']}")
+            lines.append(f"{self.prefix}_{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: str = None, prometheus_path: str = None):
+        """Write the metrics to the files that are given. The files are
+        replaced in one go so readers never see half a file"""
+        for path, text in ((json_path, self.to_json), (prometheus_path, self.to_prometheus)):
+            if path is None:
+                continue
+            with open(f"{path}.tmp", "w") as file:
+                file.write(text())
+            os.replace(f"{path}.tmp", path)
+
+    def start_export(self, interval: float, json_path: str = None, prometheus_path: str = None):
+        """Write the metrics every interval seconds until stop() is called"""
+        logger = logging.getLogger(__name__)
+        self.stop_export.clear()
+
+        def export():
+            while not self.stop_export.wait(interval):
+                try:
+                    self.write(json_path=json_path, prometheus_path=prometheus_path)
+                except OSError as e:
+                    logger.error(f"Could not export the metrics: {e}")
+
+        self.export_thread = threading.Thread(target=export, name="metrics", daemon=True)
+        self.export_thread.start()
+
+    def stop(self):
+        if self.export_thread is not None:
+            self.stop_export.set()
+            self.export_thread.join()
+            self.export_thread = None
+
+
+metrics = Metrics()
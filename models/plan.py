@@ -0,0 +1,145 @@
+import json
+from enum import Enum
+from typing import Iterable, Iterator, List, TextIO
+
+from models.wikidata import Lexeme, ForeignID
+
+
+class MatchAction(Enum):
+    ADD = "add"  # add the SAOB id
+    NO_VALUE = "novalue"  # add a novalue statement
+    SKIP = "skip"  # nothing to upload, see the reason
+
+
+# Reasons for the decisions
+UNIQUE_MATCH = "unique entry with matching category"
+MULTIPLE_MATCHES = "multiple entries with the same category"
+RANKED_MATCH = "entry with the definition most similar to the senses"
+NO_MATCHING_CATEGORY = "no entry with matching category"
+NOT_IN_SAOB = "not in the SAOB list"
+NOT_IN_DICTIONARY = "not in the dictionary"
+
+# Plans written before there were several dictionary sources are all SAOB
+default_property = "P8478"
+default_stated_in = "Q1935308"
+
+
+class PlanEntry:
+    """The decision for one lexeme in a match plan"""
+    lexeme_id: str
+    lemma: str
+    lexical_category: str
+    action: MatchAction
+    saob_id: str  # the id in the dictionary of the property
+    reason: str
+    # The SAOB ids of the homographs and their scores if ranked
+    candidates: List[str]
+    scores: List[float]
+    # The property of the dictionary and the item it is stated in
+    property: str
+    stated_in: str
+
+    def __init__(self,
+                 lexeme_id: str = None,
+                 lemma: str = None,
+                 lexical_category: str = None,
+                 action: MatchAction = None,
+                 saob_id: str = None,
+                 reason: str = None,
+                 candidates: List[str] = None,
+                 scores: List[float] = None,
+                 property: str = default_property,
+                 stated_in: str = default_stated_in):
+        if lexeme_id is None or action is None:
+            raise ValueError("Did not get the arguments needed")
+        self.lexeme_id = lexeme_id
+        self.lemma = lemma
+        self.lexical_category = lexical_category
+        self.action = action
+        self.saob_id = saob_id
+        self.reason = reason
+        self.candidates = candidates
+        self.scores = scores
+        self.property = property
+        self.stated_in = stated_in
+
+    def __str__(self):
+        return (f"PlanEntry: {self.lexeme_id} {self.lemma} {self.property} "
+                f"{self.action.value} {self.saob_id} ({self.reason})")
+
+    def to_json(self) -> str:
+        data = {
+            "lexeme_id": self.lexeme_id,
+            "lemma": self.lemma,
+            "lexical_category": self.lexical_category,
+            "action": self.action.value,
+            "saob_id": self.saob_id,
+            "reason": self.reason,
+            "property": self.property,
+            "stated_in": self.stated_in
+        }
+        if self.candidates is not None:
+            data["candidates"] = self.candidates
+        if self.scores is not None:
+            data["scores"] = self.scores
+        return json.dumps(data, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str):
+        data = json.loads(line)
+        data["action"] = MatchAction(data["action"])
+        return cls(**data)
+
+    def lexeme(self) -> Lexeme:
+        return Lexeme(id=self.lexeme_id,
+                      lemma=self.lemma,
+                      lexical_category=self.lexical_category)
+
+    def foreign_id(self, source=None) -> ForeignID:
+        """source is the models.source.DictionarySource of the property"""
+        if self.action == MatchAction.ADD:
+            return ForeignID(id=self.saob_id,
+                             property=self.property,
+                             source_item_id=self.stated_in,
+                             source=source)
+        elif self.action == MatchAction.NO_VALUE:
+            return ForeignID(property=self.property,
+                             source_item_id=self.stated_in,
+                             no_value=True,
+                             source=source)
+        else:
+            raise Exception(f"Nothing to upload for {self}")
+
+
+class MatchPlanWriter:
+    """Write a match plan as JSON lines, one PlanEntry per line"""
+    path: str
+    file: TextIO
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, entry: PlanEntry):
+        self.file.write(entry.to_json() + "\n")
+
+    def write_lines(self, lines: Iterable[str]):
+        """Write entries already converted with PlanEntry.to_json()
+        and ending with a newline"""
+        self.file.writelines(lines)
+
+    def close(self):
+        self.file.close()
+
+
+def read_plan(path: str) -> Iterator[PlanEntry]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield PlanEntry.from_json(line)
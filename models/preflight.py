@@ -0,0 +1,113 @@
+import logging
+from typing import List, Tuple, Dict
+
+import config
+from models.http_client import HTTPClient, shared_client
+from models.metrics import metrics
+from models.uploader import BatchUploader
+from models.wikidata import Lexeme, ForeignID, fetch_entities
+
+
+class Preflight:
+    """Check the current state of the lexemes right before uploading
+
+    Other editors may have added the property since the lexemes were
+    fetched. Uploads are collected in batches and the current entities
+    of a batch are fetched with one wbgetentities call. Uploads to
+    lexemes that already have a statement with the property, even a
+    novalue one, or that were deleted are dropped. The rest are passed
+    on to the uploader together with the fetched entity so it is not
+    fetched again. Its lastrevid is sent as baserevid so the API detects
+    edits made to the lexeme after it was checked.
+
+    It has the same submit() and close() as BatchUploader and is used
+    in front of it."""
+    uploader: BatchUploader
+    batch_size: int
+    pending: List[Tuple[Lexeme, ForeignID]]
+    checked_count: int
+    dropped_count: int
+
+    def __init__(self, uploader: BatchUploader = None, batch_size: int = None,
+                 session: HTTPClient = None):
+        if uploader is None:
+            raise ValueError("Did not get the arguments needed")
+        self.uploader = uploader
+        # wbgetentities takes at most 50 ids
+        self.batch_size = min(batch_size or config.preflight_batch_size, 50)
+        self.session = session or shared_client()
+        self.pending = []
+        self.checked_count = 0
+        self.dropped_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, lexeme: Lexeme = None, foreign_id: ForeignID = None):
+        if lexeme is None or foreign_id is None:
+            raise ValueError("Did not get the arguments needed")
+        if not lexeme.needs_upload(foreign_id):
+            # Let the uploader count it without checking it
+            self.uploader.submit(lexeme=lexeme, foreign_id=foreign_id)
+            return
+        self.pending.append((lexeme, foreign_id))
+        # A lexeme with several lemmas is in the batch more than once
+        if len({lexeme.id for lexeme, foreign_id in self.pending}) >= self.batch_size:
+            self.flush()
+
+    def fetch_entities(self, ids: List[str]) -> Dict[str, dict]:
+        """The current JSON of the entities, missing ones are left out"""
+        return fetch_entities(ids, session=self.session, timeout=config.preflight_timeout)
+
+    @staticmethod
+    def needs_edit(entity: dict, foreign_id: ForeignID) -> bool:
+        # Deprecated statements are ignored like in the SPARQL query
+        statements = [statement for statement in entity.get("claims", {}).get(foreign_id.property, [])
+                      if statement.get("rank") != "deprecated"]
+        return not statements
+
+    def flush(self):
+        logger = logging.getLogger(__name__)
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        ids = list(dict.fromkeys(lexeme.id for lexeme, foreign_id in batch))
+        try:
+            entities = self.fetch_entities(ids)
+        except Exception as e:
+            # Better an edit too many than none at all
+            logger.error(f"Pre-flight check of {len(ids)} lexemes failed, "
+                         f"uploading without it: {e}")
+            for lexeme, foreign_id in batch:
+                self.uploader.submit(lexeme=lexeme, foreign_id=foreign_id)
+            return
+        self.checked_count += len(ids)
+        based_on_entity = set()
+        for lexeme, foreign_id in batch:
+            entity = entities.get(lexeme.id)
+            if entity is None:
+                logger.info(f"Dropping the upload to {lexeme.id} because it was deleted")
+            elif not self.needs_edit(entity, foreign_id):
+                logger.info(f"Dropping the upload to {lexeme.id} because it already "
+                            f"has {foreign_id.property}")
+            else:
+                if lexeme.id in based_on_entity:
+                    # The first upload to the lexeme changes it so
+                    # it has to be fetched again
+                    entity = None
+                based_on_entity.add(lexeme.id)
+                self.uploader.submit(lexeme=lexeme, foreign_id=foreign_id, entity=entity)
+                continue
+            self.dropped_count += 1
+            metrics.increment("preflight_dropped")
+
+    def close(self):
+        self.flush()
+        print(self.report())
+
+    def report(self):
+        return (f"Pre-flight checked {self.checked_count} lexemes and dropped "
+                f"{self.dropped_count} uploads that were no longer needed.")
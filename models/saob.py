@@ -1,13 +1,31 @@
+import asyncio
 import json
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from csv import reader
 from enum import Enum
+from functools import partial
 from pprint import pprint
-from typing import List, Union
+from typing import List, Union, Dict, Iterable
+from urllib.parse import urlparse, parse_qsl
 
 import requests
 from bs4 import BeautifulSoup
 
+import config
+from models import saob_category
+from models.article_store import ArticleStore
+from models.http_client import HTTPClient, shared_client
+from models.metrics import metrics
+from models.subentry_cache import SubentryCache
+
+autocomplete_url = "https://www.saob.se/wp-admin/admin-ajax.php"
+# This parses strings like this "/artikel/?seek=helsko&pz=2#U_H593_49212"
+subentry_link_pattern = re.compile(r"/artikel/\?seek=([\w%]+)&pz=\d#([A-Z]\w+)")
+
 
 class SAOBSubentry:
     """Lemmas are listed as subentries on entries they
@@ -46,50 +64,71 @@ class SAOBSubentry:
     #     else:
     #         raise Exception(f"Could not parse response, see {self.search_url()}")
 
-    def search_using_api(self):
+    def search_using_api(self, cache: SubentryCache = None):
         """Search for the lemma using the suggestions API
-        Return true if found and false otherwise"""
-        logger = logging.getLogger(__name__)
-        header = {
-            "Accept": "application/json",
-        }
-        response = requests.get(
-            ("https://www.saob.se/wp-admin/admin-ajax.php?"
-             f"action=myprefix_autocompletesearch&term={self.lemma}"),
-            headers=header
-        )
+        Return true if found and false otherwise
+
+        If a cache is given it is asked first and the answer
+        from the API is stored in it"""
+        if cache is not None:
+            found = cache.lookup(self)
+            if found is not None:
+                return found
+        found = self.query_api()
+        if cache is not None:
+            cache.store(self, found)
+        return found
+
+    def query_api(self, session: HTTPClient = None):
+        response = self.get_suggestions(session)
         if response.status_code == 200:
-            logger.debug("Got 200")
-            # Clean the JSON. It has () around it
-            data = response.text.strip().replace('(', '').replace(')', '')
-            suggestions = json.loads(data)
-            # pprint(suggestions)
-            # We get a list back from the API with suggestions
-            for suggestion in suggestions:
-                # Clean away the dash
-                label = suggestion["label"].replace("-", "")
-                link = suggestion["link"]
-                # logger.debug(link)
-                if label == self.lemma:
-                    logger.debug("We found a matching subentry!")
-                    # This parses strings like this "/artikel/?seek=helsko&pz=2#U_H593_49212"
-                    pattern = "\/artikel\/\?seek=([\w%]+)&pz=\d#([A-Z]\w+)"
-                    matches: Union[List[tuple], None] = re.findall(pattern, link)
-                    logger.debug(f"matches:{matches} for {link}")
-                    # Check if we got a section_id:
-                    if matches is not None:
-                        self.seek_parameter = matches[0][0]
-                        self.section_id = matches[0][1]
-                        logger.info(self)
-                        print(self.url())
-                        return True
-                else:
-                    logger.debug(f"Skipped {label}")
-            # No match found for any of the suggestions
-            return False
+            return self.match_suggestions(response.text)
         else:
             raise Exception(f"Got {response.status_code} from SAOB.se")
 
+    def get_suggestions(self, session: HTTPClient = None):
+        """Get the response of the suggestions API for the lemma"""
+        if session is None:
+            session = shared_client()
+        header = {
+            "Accept": "application/json",
+        }
+        with metrics.request("saob_suggestions"):
+            return session.get(
+                autocomplete_url,
+                params={"action": "myprefix_autocompletesearch", "term": self.lemma},
+                headers=header,
+                timeout=config.saob_timeout
+            )
+
+    def match_suggestions(self, text: str):
+        """Populate the subentry from the suggestions in a
+        response from the API. Return true if found and false otherwise"""
+        logger = logging.getLogger(__name__)
+        # Clean the JSON. It has () around it
+        data = text.strip().replace('(', '').replace(')', '')
+        suggestions = json.loads(data)
+        # We get a list back from the API with suggestions
+        for suggestion in suggestions:
+            # Clean away the dash
+            label = suggestion["label"].replace("-", "")
+            link = suggestion["link"]
+            if label == self.lemma:
+                logger.debug("We found a matching subentry!")
+                matches: List[tuple] = subentry_link_pattern.findall(link)
+                logger.debug(f"matches:{matches} for {link}")
+                # Check if we got a section_id:
+                if matches:
+                    self.seek_parameter = matches[0][0]
+                    self.section_id = matches[0][1]
+                    logger.info(self)
+                    logger.debug(self.url())
+                    return True
+            else:
+                logger.debug(f"Skipped {label}")
+        # No match found for any of the suggestions
+        return False
+
     def search_url(self):
         try:
             return f"https://www.saob.se/artikel/?seek={self.lemma}"
@@ -122,9 +161,259 @@ class SAOBEntry():
         self.lexical_category = lexical_category
         self.number = number
 
-    def scrape_details(self):
-        """Scrape details from SAOB"""
-        pass
+    @classmethod
+    def from_csv_row(cls, row: List[str]):
+        """Create an entry from a row in the list written by get_saob_list.py
+        row[0] is null
+        row[1] = lemma
+        row[2] = lexical category
+        row[3] = number
+        row[4] = url with the id as query parameter"""
+        if row[3] == '':
+            number = 0
+        else:
+            number = int(row[3])
+        url = urlparse(row[4])
+        return cls(
+            id=dict(parse_qsl(url.query))["id"],
+            lemma=row[1],
+            lexical_category=row[2],
+            number=number
+        )
+
+    def category_qid(self) -> str:
+        """The QID of the lexical category, see saob_category.classify()"""
+        return saob_category.classify(self.lexical_category, self.lemma)
+
+    def scrape_details(self, store: ArticleStore = None, session: HTTPClient = None) -> str:
+        """The text of the article of the entry on saob.se
+
+        The page is read from the store if it has it and otherwise
+        downloaded and stored. Use scrape_details() below for many entries."""
+        if store is not None:
+            page = store.get(self.id)
+            if page is not None:
+                return article_text(page)
+        page = self.fetch_article(session)
+        if store is not None:
+            store.put(self.id, page)
+        return article_text(page)
+
+    def fetch_article(self, session: HTTPClient = None) -> bytes:
+        """Download the article page"""
+        if session is None:
+            session = shared_client()
+        with metrics.request("saob_article"):
+            response = session.get(self.url(), timeout=config.saob_timeout)
+        if response.status_code != 200:
+            raise Exception(f"Got {response.status_code} from SAOB.se for {self.id}")
+        return response.content
 
     def url(self):
         return f"https://www.saob.se/artikel/?unik={self.id}"
+
+
+
+class SAOBLemmaGroup:
+    """All entries in SAOB with the same lemma (homographs)
+
+    The entries are also grouped by the QID of their lexical category
+    when they are added so matching a lexeme is a single lookup."""
+    lemma: str
+    entries: List[SAOBEntry]
+    entries_by_category: Dict[str, List[SAOBEntry]]
+
+    def __init__(self, lemma: str, entries: Iterable[SAOBEntry] = ()):
+        self.lemma = lemma
+        self.entries = []
+        self.entries_by_category = {}
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def add(self, entry: SAOBEntry, category_qid: str = None):
+        """Add the entry. category_qid is its already classified
+        category, see models/saob_snapshot.py"""
+        if category_qid is None:
+            category_qid = entry.category_qid()
+        self.entries.append(entry)
+        self.entries_by_category.setdefault(category_qid, []).append(entry)
+
+    def matches(self, category_qid: str) -> List[SAOBEntry]:
+        """Entries with the given lexical category"""
+        return self.entries_by_category.get(category_qid, [])
+
+    def category_histogram(self) -> Dict[str, int]:
+        return {category: len(entries) for category, entries in self.entries_by_category.items()}
+
+
+def load_saob_into_memory(csv_path: str = None) -> Dict[str, SAOBLemmaGroup]:
+    # load all entries into a dictionary with the lemma as key and a
+    # SAOBLemmaGroup as value so that homographs can be found with a single lookup
+    if csv_path is None:
+        csv_path = config.saob_csv
+    print("Loading SAOB into memory")
+    saob_lemma_index: Dict[str, SAOBLemmaGroup] = {}
+    # open file in read mode
+    with open(csv_path, 'r') as read_obj:
+        # pass the file object to reader() to get the reader object
+        csv_reader = reader(read_obj)
+        count = 0
+        # Iterate over each row in the csv using reader object
+        for row in csv_reader:
+            # row variable is a list that represents a row in csv
+            entry = SAOBEntry.from_csv_row(row)
+            group = saob_lemma_index.get(entry.lemma)
+            if group is None:
+                group = saob_lemma_index[entry.lemma] = SAOBLemmaGroup(entry.lemma)
+            group.add(entry)
+            count += 1
+    print(f"loaded {count} saob lines into {len(saob_lemma_index)} distinct saob lemmas")
+    # exit(0)
+    return saob_lemma_index
+
+
+def resolve_subentries(lemmas: Iterable[str],
+                       concurrency: int = None,
+                       cache: SubentryCache = None) -> Dict[str, SAOBSubentry]:
+    """Search for many lemmas concurrently using the suggestions API
+    Returns a dictionary with the lemma as key for the subentries found"""
+    return asyncio.run(resolve_subentries_async(lemmas, concurrency=concurrency, cache=cache))
+
+
+async def resolve_subentries_async(lemmas: Iterable[str],
+                                   concurrency: int = None,
+                                   cache: SubentryCache = None) -> Dict[str, SAOBSubentry]:
+    """See resolve_subentries()
+
+    At most concurrency requests are made at the same time over the
+    keep-alive connections of the shared HTTP client which also retries
+    failed requests. A lemma whose lookup fails or gives a response that
+    cannot be read is logged and left out without being cached. The cache
+    is only used from the event loop."""
+    logger = logging.getLogger(__name__)
+    if concurrency is None:
+        concurrency = config.subentry_concurrency
+    subentries = {}
+    pending = []
+    for lemma in dict.fromkeys(lemmas):
+        subentry = SAOBSubentry(lemma)
+        found = None
+        if cache is not None:
+            found = cache.lookup(subentry)
+        if found is None:
+            pending.append(subentry)
+        elif found:
+            subentries[lemma] = subentry
+    logger.info(f"Resolving {len(pending)} lemmas using the suggestions API")
+    client = shared_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def resolve(subentry: SAOBSubentry):
+        async with semaphore:
+            try:
+                response = await loop.run_in_executor(
+                    executor, partial(subentry.get_suggestions, client)
+                )
+            except requests.RequestException as e:
+                problem = e
+            else:
+                if response.status_code == 200:
+                    try:
+                        return subentry, subentry.match_suggestions(response.text)
+                    except (ValueError, KeyError, TypeError) as e:
+                        # Not the JSON we expected, e.g. an error page
+                        problem = f"an unreadable response: {e}"
+                else:
+                    problem = f"status {response.status_code}"
+            logger.error(f"Giving up on {subentry.lemma} after {problem}")
+            metrics.increment("subentry_lookups_failed")
+            return subentry, None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for next_result in asyncio.as_completed([resolve(subentry) for subentry in pending]):
+            subentry, found = await next_result
+            if found is None:
+                continue
+            if cache is not None:
+                cache.store(subentry, found)
+            if found:
+                subentries[subentry.lemma] = subentry
+    metrics.increment("subentries_found", len(subentries))
+    return subentries
+
+
+def article_text(page: Union[bytes, str]) -> str:
+    """The text of the article on a page from SAOBEntry.fetch_article()
+    without the menus and scripts around it"""
+    soup = BeautifulSoup(page, features="html.parser")
+    for tag in soup(["script", "style", "nav", "header", "footer"]):
+        tag.decompose()
+    article = soup.select_one(".artikel") or soup.body or soup
+    return article.get_text(" ", strip=True)
+
+
+def scrape_details(entries: Iterable[SAOBEntry],
+                   store: ArticleStore = None,
+                   concurrency: int = None,
+                   requests_per_minute: float = None,
+                   refetch: bool = False) -> int:
+    """Download the article pages of many entries into the store
+
+    Entries already in the store are skipped unless refetch is true. At
+    most concurrency pages are downloaded at a time and new downloads are
+    started at most requests_per_minute times a minute to be polite to
+    saob.se. Failed downloads are logged and left for the next run.
+    The store is only written to from this thread.
+    Returns the number of pages downloaded."""
+    logger = logging.getLogger(__name__)
+    if store is None:
+        raise ValueError("Did not get the arguments needed")
+    if concurrency is None:
+        concurrency = config.article_concurrency
+    if requests_per_minute is None:
+        requests_per_minute = config.article_requests_per_minute
+    pending = {}
+    for entry in entries:
+        if entry.id not in pending and (refetch or entry.id not in store):
+            pending[entry.id] = entry
+    logger.info(f"Downloading {len(pending)} SAOB articles")
+    client = shared_client()
+    lock = threading.Lock()
+    next_slot = time.monotonic()
+
+    def fetch(entry: SAOBEntry) -> bytes:
+        nonlocal next_slot
+        with lock:
+            now = time.monotonic()
+            slot = max(next_slot, now)
+            next_slot = slot + 60 / requests_per_minute
+        if slot > now:
+            time.sleep(slot - now)
+        return entry.fetch_article(client)
+
+    fetched_count = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch, entry): entry for entry in pending.values()}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                page = future.result()
+            except Exception as e:
+                logger.error(f"Could not download the article of {entry.id}: {e}")
+                metrics.increment("saob_articles_failed")
+                continue
+            store.put(entry.id, page)
+            fetched_count += 1
+            if fetched_count % 100 == 0:
+                store.commit()
+                logger.info(f"Downloaded {fetched_count} of {len(pending)} articles")
+    store.commit()
+    metrics.increment("saob_articles_downloaded", fetched_count)
+    return fetched_count
@@ -0,0 +1,68 @@
+from functools import lru_cache
+from typing import Set
+
+# Results of classify() that are not QIDs
+NO_CATEGORY = "none"
+IGNORE = "ignore"
+UNKNOWN = "unknown"
+NOT_QIDS = (NO_CATEGORY, IGNORE, UNKNOWN)
+
+# Which lemmas a rule applies to
+ANY = "any"
+AFFIX = "affix"  # lemmas with a dash like -fil
+
+# Rules to map the lexical category in SAOB to a Wikidata QID.
+# They are checked in order and the first one that matches wins.
+# (test, text in the SAOB category, lemmas, QID)
+category_rules = [
+    ("contains", "verb", ANY, "Q24905"),  # verb
+    # handle affixes like -fil also being marked as subst in SAOB
+    ("contains", "subst", AFFIX, "Q62155"),  # affix
+    ("contains", "subst", ANY, "Q1084"),  # noun
+    ("contains", "adj", ANY, "Q34698"),  # adjective
+    ("contains", "adv", ANY, "Q380057"),  # adverb
+    ("contains", "konj", ANY, "Q36484"),  # conjunction
+    ("contains", "interj", ANY, "Q83034"),  # interjection
+    ("contains", "prep", ANY, "Q4833830"),  # preposition
+    ("contains", "räkn", ANY, "Q63116"),  # numeral
+    ("contains", "artikel", ANY, "Q103184"),  # article
+    ("contains", "pron", ANY, "Q36224"),  # pronoun
+    ("equals", "prefix", ANY, "Q62155"),  # affix
+    ("equals", "suffix", ANY, "Q62155"),
+    ("equals", "affix", ANY, "Q62155"),
+    # this covers all special cases like this one: https://svenska.se/saob/?id=O_0283-0242.Qqdq&pz=5
+    ("contains", "(", ANY, IGNORE),
+    ("contains", "ssgled", ANY, IGNORE),
+]
+
+# Categories that no rule recognized during this run
+unrecognized_categories: Set[str] = set()
+
+
+def classify(lexical_category: str = None, lemma: str = "") -> str:
+    """Return the QID of the lexical category in SAOB or one of
+    NO_CATEGORY, IGNORE and UNKNOWN. Each distinct category is
+    only run through the rules once."""
+    return classify_category(lexical_category or "", "-" in (lemma or ""))
+
+
+@lru_cache(maxsize=None)
+def classify_category(lexical_category: str, affix: bool) -> str:
+    if lexical_category == "":
+        return NO_CATEGORY
+    for test, text, lemmas, qid in category_rules:
+        if lemmas == AFFIX and not affix:
+            continue
+        if test == "contains" and text in lexical_category:
+            return qid
+        if test == "equals" and text == lexical_category:
+            return qid
+    unrecognized_categories.add(lexical_category)
+    return UNKNOWN
+
+
+def report():
+    if not unrecognized_categories:
+        return "All SAOB categories were recognized"
+    return (f"{len(unrecognized_categories)} SAOB categories were not recognized: "
+            f"{', '.join(sorted(unrecognized_categories))}")
@@ -0,0 +1,78 @@
+import html
+import re
+from typing import List, Tuple, Union
+
+from bs4 import BeautifulSoup
+
+# These work directly on the bytes of the response from admin-ajax.php
+# and find the same things as the BeautifulSoup parser in get_saob_list.py
+# without building a tree of the page. Links with nested spans are
+# parsed with BeautifulSoup, see parse_link().
+link_pattern = re.compile(
+    rb'<a\s([^>]*\bclass=["\'][^"\']*\bslank\b[^"\']*["\'][^>]*)>(.*?)</a>',
+    re.S | re.I
+)
+href_pattern = re.compile(rb'\bhref=["\']([^"\']*)["\']', re.I)
+span_pattern = re.compile(rb'<span\b[^>]*>(.*?)</span>', re.S | re.I)
+span_start_pattern = re.compile(rb'<span\b', re.I)
+tag_pattern = re.compile(rb'<[^>]+>')
+cursor_patterns = {
+    direction: re.compile(
+        rb'<div\s[^>]*\bclass=["\'][^"\']*\bpil' + direction.encode() +
+        rb'\b[^"\']*["\'][^>]*>.*?<a\s[^>]*\bunik=["\']([^"\']*)["\']',
+        re.S | re.I
+    )
+    for direction in ("ned", "upp")
+}
+
+
+def text(content: bytes) -> str:
+    """Same as getText().strip() in BeautifulSoup"""
+    return html.unescape(tag_pattern.sub(b"", content).decode("utf-8")).strip()
+
+
+def parse_link(attributes: bytes, inner: bytes) -> List[str]:
+    """The row of one link parsed with BeautifulSoup like
+    gather_information() in get_saob_list.py"""
+    link = BeautifulSoup((b"<a " + attributes + b">" + inner + b"</a>").decode("utf-8"),
+                         features="html.parser").a
+    spans = link.findAll("span")
+    return [spans[0].getText().strip(),
+            spans[1].getText().strip(),
+            spans[2].getText().strip(),
+            spans[3].getText().strip(),
+            link["href"].strip()]
+
+
+def extract_rows(content: bytes,
+                 direction: str = "ned",
+                 keep_cursor: bool = False) -> Tuple[List[List[str]], Union[str, int]]:
+    """Return the rows on a list page and the next cursor
+    which is -1 at the end of the list"""
+    links = link_pattern.findall(content)
+    if len(links) == 0:
+        return [], -1
+    # The link of the cursor is repeated on the page
+    if not keep_cursor:
+        if direction == "upp":
+            links = links[:-1]
+        else:
+            links = links[1:]
+    rows = []
+    for attributes, inner in links:
+        spans = span_pattern.findall(inner)
+        if any(span_start_pattern.search(span) for span in spans):
+            # The pattern ends a span at the first </span> so it cannot
+            # pair nested spans
+            rows.append(parse_link(attributes, inner))
+            continue
+        href = href_pattern.search(attributes)
+        rows.append([text(spans[0]),
+                     text(spans[1]),
+                     text(spans[2]),
+                     text(spans[3]),
+                     html.unescape(href.group(1).decode("utf-8")).strip()])
+    cursor = cursor_patterns[direction].search(content)
+    if cursor is None:
+        raise Exception(f"Could not find the next cursor on the page: {content[:200]}")
+    return rows, html.unescape(cursor.group(1).decode("utf-8"))
@@ -0,0 +1,305 @@
+import hashlib
+import logging
+import mmap
+import struct
+import sys
+from array import array
+from csv import reader
+from typing import List, Dict, Iterator
+
+from models import saob_category
+from models.saob import SAOBEntry, SAOBLemmaGroup
+
+
+def rules_digest() -> bytes:
+    """Fingerprint of the category rules the QIDs in a snapshot were
+    classified with"""
+    return hashlib.sha256(repr(saob_category.category_rules).encode("utf-8")).digest()[:8]
+
+
+class SAOBSnapshot:
+    """Read-only, memory-mapped binary snapshot of the SAOB list
+
+    The snapshot is written once from the CSV produced by get_saob_list.py
+    and can then be opened in milliseconds. The file is mapped read-only
+    so several processes opening the same snapshot share the same pages.
+
+    Layout (little endian):
+    header: magic, version, row count, lemma count, category count,
+            QID count, digest of the category rules
+            followed by (offset, length) for every section below
+    lemma_offsets:    uint32[lemma_count + 1] offsets into lemma_blob
+    lemma_first_row:  uint32[lemma_count + 1] first row of each lemma
+    lemma_blob:       utf-8 lemmas sorted by their utf-8 bytes
+    category_offsets: uint32[category_count + 1]
+    category_blob:    utf-8 distinct lexical categories
+    id_offsets:       uint32[row_count + 1]
+    id_blob:          utf-8 SAOB ids
+    row_category:     uint16[row_count] index into the category table
+    row_number:       int32[row_count] the SAOB number
+    qid_offsets:      uint32[qid_count + 1]
+    qid_blob:         utf-8 distinct results of saob_category.classify()
+    row_qid:          uint16[row_count] index into the QID table
+
+    Rows are sorted by lemma (homographs keep their order from the CSV)
+    so all entries of a lemma are found with one binary search. The
+    categories are classified once when the snapshot is written so the
+    entries of a lemma are grouped by QID without classifying them again.
+    A snapshot written with other category rules is classified when read
+    instead, rebuild it to get the fast path back."""
+    magic = b"SAOBSNAP"
+    version = 2
+    sections = ("lemma_offsets", "lemma_first_row", "lemma_blob",
+                "category_offsets", "category_blob",
+                "id_offsets", "id_blob",
+                "row_category", "row_number",
+                "qid_offsets", "qid_blob", "row_qid")
+    header_format = "<8sIIIII8s" + "II" * len(sections)
+    path: str
+    row_count: int
+    lemma_count: int
+    category_count: int
+    qid_count: int
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise Exception("SAOB snapshots can only be read on little endian machines")
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version = struct.unpack_from("<8sI", self._mmap)
+        if magic != self.magic or version != self.version:
+            raise Exception(f"{path} is not a version {self.version} SAOB snapshot, "
+                            f"rebuild it with build_saob_snapshot.py")
+        header = struct.unpack_from(self.header_format, self._mmap)
+        (self.row_count, self.lemma_count, self.category_count,
+         self.qid_count, digest) = header[2:7]
+        positions = header[7:]
+        section = {}
+        for number, name in enumerate(self.sections):
+            offset, length = positions[number * 2], positions[number * 2 + 1]
+            section[name] = self._view[offset:offset + length]
+        self._lemma_offsets = section["lemma_offsets"].cast("I")
+        self._lemma_first_row = section["lemma_first_row"].cast("I")
+        self._lemma_blob = section["lemma_blob"]
+        self._id_offsets = section["id_offsets"].cast("I")
+        self._id_blob = section["id_blob"]
+        self._row_category = section["row_category"].cast("H")
+        self._row_number = section["row_number"].cast("i")
+        self._row_qid = section["row_qid"].cast("H")
+        # The category and QID tables are tiny so we decode them once
+        self.categories: List[str] = self._decode_table(
+            section["category_offsets"], section["category_blob"], self.category_count)
+        self.qids: List[str] = self._decode_table(
+            section["qid_offsets"], section["qid_blob"], self.qid_count)
+        self.classified = digest == rules_digest()
+        if not self.classified:
+            logging.getLogger(__name__).warning(
+                f"{path} was written with other category rules, classifying its "
+                f"categories while matching. Rebuild it with build_saob_snapshot.py"
+            )
+
+    @staticmethod
+    def _decode_table(offsets: memoryview, blob: memoryview, count: int) -> List[str]:
+        offsets = offsets.cast("I")
+        table = [bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(count)]
+        offsets.release()
+        return table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def __contains__(self, lemma: str):
+        return self._find_lemma(lemma) != -1
+
+    def __getitem__(self, lemma: str) -> SAOBLemmaGroup:
+        group = self.get(lemma)
+        if group is None:
+            raise KeyError(lemma)
+        return group
+
+    def __str__(self):
+        return (f"SAOBSnapshot: {self.path} with {self.row_count} rows, "
+                f"{self.lemma_count} lemmas and {self.category_count} categories")
+
+    def close(self):
+        for view in (self._lemma_offsets, self._lemma_first_row, self._lemma_blob,
+                     self._id_offsets, self._id_blob, self._row_category,
+                     self._row_number, self._row_qid, self._view):
+            view.release()
+        self._mmap.close()
+
+    def _lemma_bytes(self, index: int) -> bytes:
+        return bytes(self._lemma_blob[self._lemma_offsets[index]:self._lemma_offsets[index + 1]])
+
+    def _find_lemma(self, lemma: str) -> int:
+        """Binary search in the sorted lemma table.
+        Returns the lemma index or -1"""
+        key = lemma.encode("utf-8")
+        low, high = 0, self.lemma_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._lemma_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.lemma_count and self._lemma_bytes(low) == key:
+            return low
+        return -1
+
+    def _group(self, index: int, lemma: str) -> SAOBLemmaGroup:
+        group = SAOBLemmaGroup(lemma)
+        for row in range(self._lemma_first_row[index], self._lemma_first_row[index + 1]):
+            entry = self.entry(row, lemma=lemma)
+            if self.classified:
+                qid = self.qids[self._row_qid[row]]
+                if qid == saob_category.UNKNOWN:
+                    # Reported at the end of the run like when classifying
+                    saob_category.unrecognized_categories.add(entry.lexical_category)
+                group.add(entry, qid)
+            else:
+                group.add(entry)
+        return group
+
+    def group(self, index: int) -> SAOBLemmaGroup:
+        """The group of the lemma at index in lemmas()"""
+        return self._group(index, self._lemma_bytes(index).decode("utf-8"))
+
+    def entry(self, row: int, lemma: str = None) -> SAOBEntry:
+        """Create a SAOBEntry for the given row"""
+        if lemma is None:
+            lemma = self.lemma_of_row(row)
+        return SAOBEntry(
+            id=bytes(self._id_blob[self._id_offsets[row]:self._id_offsets[row + 1]]).decode("utf-8"),
+            lemma=lemma,
+            lexical_category=self.categories[self._row_category[row]],
+            number=self._row_number[row]
+        )
+
+    def lemma_of_row(self, row: int) -> str:
+        # find the last lemma whose first row is <= row
+        low, high = 0, self.lemma_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._lemma_first_row[middle + 1] <= row:
+                low = middle + 1
+            else:
+                high = middle
+        return self._lemma_bytes(low).decode("utf-8")
+
+    def get(self, lemma: str, default=None) -> SAOBLemmaGroup:
+        """Same as dict.get() on the lemma index from load_saob_into_memory()"""
+        index = self._find_lemma(lemma)
+        if index == -1:
+            return default
+        return self._group(index, lemma)
+
+    def lemmas(self) -> Iterator[str]:
+        """All distinct lemmas in sorted order"""
+        for index in range(self.lemma_count):
+            yield self._lemma_bytes(index).decode("utf-8")
+
+    def groups(self) -> Iterator[SAOBLemmaGroup]:
+        """All lemma groups in sorted order"""
+        for index in range(self.lemma_count):
+            yield self.group(index)
+
+    @classmethod
+    def write_from_csv(cls, csv_path: str, snapshot_path: str):
+        """Convert the CSV list from get_saob_list.py to a snapshot"""
+        with open(csv_path, 'r') as read_obj:
+            entries = [SAOBEntry.from_csv_row(row) for row in reader(read_obj)]
+        cls.write(entries, snapshot_path)
+
+    @classmethod
+    def write(cls, entries: List[SAOBEntry], snapshot_path: str):
+        logger = logging.getLogger(__name__)
+        # sorted() is stable so homographs keep their order
+        keys = [entry.lemma.encode("utf-8") for entry in entries]
+        order = sorted(range(len(entries)), key=keys.__getitem__)
+        lemma_offsets = array("I", [0])
+        lemma_first_row = array("I")
+        lemma_blob = bytearray()
+        category_codes: Dict[str, int] = {}
+        category_offsets = array("I", [0])
+        category_blob = bytearray()
+        id_offsets = array("I", [0])
+        id_blob = bytearray()
+        row_category = array("H")
+        row_number = array("i")
+        qid_codes: Dict[str, int] = {}
+        qid_offsets = array("I", [0])
+        qid_blob = bytearray()
+        row_qid = array("H")
+        previous_key = None
+        for row, position in enumerate(order):
+            entry = entries[position]
+            key = keys[position]
+            if key != previous_key:
+                lemma_blob += key
+                lemma_offsets.append(len(lemma_blob))
+                lemma_first_row.append(row)
+                previous_key = key
+            category = entry.lexical_category or ""
+            if category not in category_codes:
+                category_codes[category] = len(category_codes)
+                category_blob += category.encode("utf-8")
+                category_offsets.append(len(category_blob))
+            row_category.append(category_codes[category])
+            qid = entry.category_qid()
+            if qid not in qid_codes:
+                qid_codes[qid] = len(qid_codes)
+                qid_blob += qid.encode("utf-8")
+                qid_offsets.append(len(qid_blob))
+            row_qid.append(qid_codes[qid])
+            row_number.append(entry.number or 0)
+            id_blob += entry.id.encode("utf-8")
+            id_offsets.append(len(id_blob))
+        lemma_first_row.append(len(entries))
+        if len(category_codes) > 0xFFFF:
+            raise Exception("Too many distinct lexical categories for a snapshot")
+        payloads = {
+            "lemma_offsets": lemma_offsets.tobytes(),
+            "lemma_first_row": lemma_first_row.tobytes(),
+            "lemma_blob": bytes(lemma_blob),
+            "category_offsets": category_offsets.tobytes(),
+            "category_blob": bytes(category_blob),
+            "id_offsets": id_offsets.tobytes(),
+            "id_blob": bytes(id_blob),
+            "row_category": row_category.tobytes(),
+            "row_number": row_number.tobytes(),
+            "qid_offsets": qid_offsets.tobytes(),
+            "qid_blob": bytes(qid_blob),
+            "row_qid": row_qid.tobytes(),
+        }
+        if sys.byteorder != "little":
+            for name, values in (("lemma_offsets", lemma_offsets), ("lemma_first_row", lemma_first_row),
+                                 ("category_offsets", category_offsets), ("id_offsets", id_offsets),
+                                 ("row_category", row_category), ("row_number", row_number),
+                                 ("qid_offsets", qid_offsets), ("row_qid", row_qid)):
+                values.byteswap()
+                payloads[name] = values.tobytes()
+        # Sections are 4 byte aligned so they can be cast without copying
+        position = struct.calcsize(cls.header_format)
+        positions = []
+        for name in cls.sections:
+            position += -position % 4
+            positions += [position, len(payloads[name])]
+            position += len(payloads[name])
+        with open(snapshot_path, "wb") as file:
+            file.write(struct.pack(cls.header_format, cls.magic, cls.version,
+                                   len(entries), len(lemma_first_row) - 1,
+                                   len(category_codes), len(qid_codes), rules_digest(),
+                                   *positions))
+            for number, name in enumerate(cls.sections):
+                file.write(b"\0" * (positions[number * 2] - file.tell()))
+                file.write(payloads[name])
+        logger.info(f"Wrote {len(entries)} rows with {len(lemma_first_row) - 1} "
+                    f"lemmas to {snapshot_path}")
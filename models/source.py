@@ -0,0 +1,185 @@
+import logging
+import os
+from csv import reader
+from typing import Dict, List, Union
+
+import config
+from models import plan, saob, saob_category
+from models.metrics import metrics
+from models.saob import SAOBLemmaGroup
+from models.saob_snapshot import SAOBSnapshot
+from models.wikidata import ForeignID, Lexeme
+
+
+class DictionarySource:
+    """A dictionary whose ids are added to the lexemes of a language
+
+    A source declares the language of its lemmas, the external id property,
+    the item the ids are stated in and how its lexical categories map to
+    QIDs, and loads its lemma index. The index is anything with get(lemma)
+    returning the SAOBLemmaGroup of the lemma or None. The groups work for
+    the entries of any source.
+
+    All enabled sources of a language share one fetch of the lexemes,
+    see lexsaob.match_sources()."""
+    name: str
+    title: str  # used in edit summaries
+    language_code: str  # see models.wikidata.WikimediaLanguageCode
+    property: str
+    stated_in: str
+    # Add a novalue statement to lexemes not in the dictionary
+    add_no_value: bool = False
+    not_found_reason: str = plan.NOT_IN_DICTIONARY
+    # SAOB can also look up subentries and rank homographs by their articles
+    has_subentries: bool = False
+    has_articles: bool = False
+
+    def __str__(self):
+        return f"{self.name} ({self.property})"
+
+    def load_index(self):
+        raise NotImplementedError
+
+    def category_qid(self, category: str, lemma: str) -> str:
+        """The QID of a lexical category of the dictionary"""
+        raise NotImplementedError
+
+    def lacks(self, lexeme: Lexeme) -> bool:
+        """Whether the lexeme has no statement with the property"""
+        return lexeme.missing_properties is None or self.property in lexeme.missing_properties
+
+    def covers(self, lemma: str) -> bool:
+        """Whether the lemma would be in the dictionary if it had it,
+        novalue statements are only added to lemmas it covers"""
+        return True
+
+    def edit_summary(self, foreign_id: ForeignID) -> str:
+        if foreign_id.no_value:
+            return f"Added that the lemma is not in {self.title} with [[{config.tool_url}]]"
+        return f"Added the {self.title} identifier with [[{config.tool_url}]]"
+
+
+class SAOBSource(DictionarySource):
+    """Svenska Akademiens ordbok"""
+    name = "saob"
+    title = "SAOB"
+    language_code = "sv"
+    property = "P8478"
+    stated_in = "Q1935308"
+    not_found_reason = plan.NOT_IN_SAOB
+    has_subentries = True
+    has_articles = True
+    # SAOB has only been published from a to u so far,
+    # see https://www.saob.se/artikel/?pz=1&seek=%C3%A4rva
+    published_letters = "abcdefghijklmnopqrstu"
+
+    def __init__(self):
+        self.add_no_value = config.add_no_value
+
+    def covers(self, lemma: str) -> bool:
+        return lemma[:1] in self.published_letters
+
+    def load_index(self) -> Union[Dict[str, SAOBLemmaGroup], SAOBSnapshot]:
+        """Return the lemma index from the binary snapshot if it exists
+        and fall back to parsing the CSV otherwise"""
+        logger = logging.getLogger(__name__)
+        with metrics.stage("load_saob"):
+            if config.saob_snapshot is not None and os.path.exists(config.saob_snapshot):
+                snapshot = SAOBSnapshot(config.saob_snapshot)
+                logger.info(f"Loaded {snapshot}")
+                return snapshot
+            else:
+                logger.info("No SAOB snapshot found, run build_saob_snapshot.py "
+                            "to speed up loading")
+                return saob.load_saob_into_memory()
+
+    def category_qid(self, category: str, lemma: str) -> str:
+        return saob_category.classify(category, lemma)
+
+
+class DictionaryEntry:
+    """An entry of a CSVSource"""
+    id: str
+    lemma: str
+    lexical_category: str
+    source: DictionarySource
+
+    def __init__(self, id: str, lemma: str, lexical_category: str, source: DictionarySource):
+        self.id = id
+        self.lemma = lemma
+        self.lexical_category = lexical_category
+        self.source = source
+
+    def category_qid(self) -> str:
+        return self.source.category_qid(self.lexical_category, self.lemma)
+
+
+class CSVSource(DictionarySource):
+    """A dictionary in a CSV file with the columns lemma, lexical category
+    and id. Declare a new dictionary by subclassing it like this
+
+    class ExampleSource(CSVSource):
+        name = "example"
+        title = "Example Dictionary"
+        language_code = "da"
+        property = "P1234"
+        stated_in = "Q5678"
+        csv_path = "example.csv"
+        categories = {"sb.": "Q1084", "vb.": "Q24905"}
+
+    and adding it to source_classes. Entries with other categories never match."""
+    csv_path: str
+    categories: Dict[str, str] = {}
+
+    def category_qid(self, category: str, lemma: str) -> str:
+        return self.categories.get(category)
+
+    def load_index(self) -> Dict[str, SAOBLemmaGroup]:
+        logger = logging.getLogger(__name__)
+        index: Dict[str, SAOBLemmaGroup] = {}
+        skipped_count = 0
+        with metrics.stage(f"load_{self.name}"):
+            with open(self.csv_path, newline="", encoding="utf-8") as file:
+                for line_number, row in enumerate(reader(file), 1):
+                    if len(row) != 3 or not row[0] or not row[2]:
+                        # A broken row should not stop the whole run
+                        logger.warning(f"Skipping row {line_number} of {self.csv_path} "
+                                       f"that is not a lemma, category and id: {row}")
+                        skipped_count += 1
+                        continue
+                    lemma, category, id = row
+                    group = index.get(lemma)
+                    if group is None:
+                        group = index[lemma] = SAOBLemmaGroup(lemma)
+                    group.add(DictionaryEntry(id=id, lemma=lemma,
+                                              lexical_category=category, source=self))
+        metrics.increment(f"{self.name}_rows_skipped", skipped_count)
+        logger.info(f"Loaded {len(index)} distinct lemmas of {self}, "
+                    f"skipped {skipped_count} broken rows")
+        return index
+
+
+# The sources that can be enabled by name in config.sources
+source_classes = {
+    "saob": SAOBSource,
+}
+
+
+def source_for_property(property: str) -> DictionarySource:
+    """The known source of the property, e.g. of an entry in a plan"""
+    for source_class in source_classes.values():
+        if source_class.property == property:
+            return source_class()
+    raise Exception(f"No dictionary source has the property {property}")
+
+
+def enabled_sources(names: List[str] = None) -> List[DictionarySource]:
+    if names is None:
+        names = config.sources
+    sources = []
+    for name in names:
+        if name not in source_classes:
+            raise Exception(f"Unknown dictionary source {name}, "
+                            f"the known ones are {', '.join(source_classes)}")
+        sources.append(source_classes[name]())
+    return sources
@@ -0,0 +1,121 @@
+import logging
+import sqlite3
+import time
+from typing import Union
+
+import config
+
+
+class SubentryCache:
+    """Persistent cache of SAOB autocomplete lookups keyed by lemma
+
+    Both hits (seek parameter and section id) and misses are stored in
+    a SQLite file. Rows older than ttl_days are ignored and evicted and
+    the oldest rows are evicted when there are more than max_entries.
+    Stored rows are committed every commit_interval stores or
+    commit_seconds so a crash loses at most that many lookups."""
+    path: str
+    ttl: float
+    max_entries: int
+    hits: int
+    misses: int
+    evict_interval = 1000  # stores between size checks
+    commit_interval = 50  # stores between commits
+    commit_seconds = 10.0  # or seconds, whichever comes first
+
+    def __init__(self,
+                 path: str = None,
+                 ttl_days: float = None,
+                 max_entries: int = None):
+        self.path = path or config.subentry_cache_path
+        self.ttl = (ttl_days or config.subentry_cache_ttl_days) * 24 * 3600
+        self.max_entries = max_entries or config.subentry_cache_max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.committed_at = time.monotonic()
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS subentries ("
+            "lemma TEXT PRIMARY KEY, "
+            "found INTEGER NOT NULL, "
+            "seek_parameter TEXT, "
+            "section_id TEXT, "
+            "fetched_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS subentries_fetched_at ON subentries (fetched_at)"
+        )
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def lookup(self, subentry) -> Union[bool, None]:
+        """Return whether the subentry was found and populate it from
+        the cache or None if the lemma is not cached"""
+        row = self.connection.execute(
+            "SELECT found, seek_parameter, section_id FROM subentries "
+            "WHERE lemma = ? AND fetched_at > ?",
+            (subentry.lemma, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        found, subentry.seek_parameter, subentry.section_id = row
+        return bool(found)
+
+    def store(self, subentry, found: bool):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO subentries VALUES (?, ?, ?, ?, ?)",
+            (subentry.lemma, int(found), subentry.seek_parameter,
+             subentry.section_id, time.time())
+        )
+        self.stores += 1
+        if self.stores % self.evict_interval == 0:
+            self.evict()
+        elif (self.stores % self.commit_interval == 0
+              or time.monotonic() - self.committed_at >= self.commit_seconds):
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.committed_at = time.monotonic()
+
+    def evict(self):
+        logger = logging.getLogger(__name__)
+        with self.connection:
+            expired = self.connection.execute(
+                "DELETE FROM subentries WHERE fetched_at <= ?",
+                (time.time() - self.ttl,)
+            ).rowcount
+            count = self.connection.execute("SELECT COUNT(*) FROM subentries").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM subentries WHERE lemma IN ("
+                    "SELECT lemma FROM subentries ORDER BY fetched_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+        # The with block committed the stored rows too
+        self.committed_at = time.monotonic()
+        if expired or count > self.max_entries:
+            logger.info(f"Evicted {expired} expired and "
+                        f"{max(count - self.max_entries, 0)} old subentries from the cache")
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def report(self):
+        return (f"Subentry cache: {self.hits} hits and {self.misses} misses "
+                f"(hit rate {round(self.hit_rate() * 100)}%)")
@@ -0,0 +1,131 @@
+import logging
+import queue
+import threading
+import time
+from functools import partial
+from typing import List, Tuple, Callable
+
+import config
+from models.edit_scheduler import EditScheduler
+from models.metrics import metrics
+from models.wikidata import Lexeme, ForeignID
+
+
+class BatchUploader:
+    """Upload foreign ids in the background
+
+    Matching puts uploads on a bounded queue with submit() and a
+    small pool of worker threads write them to Wikidata using the shared
+    config.login_instance, at most edits_per_minute edits per minute.
+    The rate is lowered when Wikidata is lagged or throttles us, see
+    models/edit_scheduler.py
+
+    on_success is called from the worker thread with the lexeme and
+    foreign id after every successful upload.
+
+    Use it as a context manager or call start() and close()."""
+    workers: int
+    edits_per_minute: int
+    latencies: List[float]
+    failures: List[Tuple[str, str]]
+    skipped_count: int
+
+    def __init__(self,
+                 workers: int = None,
+                 edits_per_minute: int = None,
+                 queue_size: int = None,
+                 on_success: Callable[[Lexeme, ForeignID], None] = None):
+        self.on_success = on_success
+        self.workers = workers or config.upload_workers
+        self.edits_per_minute = edits_per_minute or config.edits_per_minute
+        self.queue = queue.Queue(maxsize=queue_size or config.upload_queue_size)
+        self.scheduler = EditScheduler(self.edits_per_minute)
+        self.latencies = []
+        self.failures = []
+        self.skipped_count = 0
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        logger = logging.getLogger(__name__)
+        logger.info(f"Starting {self.workers} upload workers "
+                    f"with a limit of {self.edits_per_minute} edits per minute")
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name=f"uploader-{number}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, lexeme: Lexeme = None, foreign_id: ForeignID = None, entity: dict = None):
+        """Queue an upload. Blocks when the queue is full so
+        matching cannot run away from the uploads
+
+        entity is the current JSON of the lexeme if it was already
+        fetched, see models/preflight.py"""
+        if lexeme is None or foreign_id is None:
+            raise ValueError("Did not get the arguments needed")
+        if not self.threads:
+            raise Exception("The uploader has not been started")
+        if not lexeme.needs_upload(foreign_id):
+            with self.lock:
+                self.skipped_count += 1
+            metrics.increment("uploads_skipped")
+            return
+        self.queue.put((lexeme, foreign_id, entity))
+
+    def close(self):
+        """Wait for all queued uploads and stop the workers"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        print(self.report())
+
+    def _work(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            lexeme, foreign_id, entity = job
+            start = time.monotonic()
+            try:
+                self.scheduler.run(partial(lexeme.upload_foreign_id_to_wikidata,
+                                           foreign_id=foreign_id, entity=entity))
+            except Exception as e:
+                logger.error(f"Upload to {lexeme.id} failed: {e}")
+                with self.lock:
+                    self.failures.append((lexeme.id, str(e)))
+                metrics.increment("uploads_failed")
+            else:
+                latency = time.monotonic() - start
+                logger.debug(f"Upload to {lexeme.id} took {round(latency, 3)}s")
+                with self.lock:
+                    self.latencies.append(latency)
+                if self.on_success is not None:
+                    self.on_success(lexeme, foreign_id)
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            failures = list(self.failures)
+        text = (f"Uploaded {len(latencies)} edits, "
+                f"{len(failures)} failed and "
+                f"{self.skipped_count} were skipped.")
+        if latencies:
+            text += (f" Latency mean {round(sum(latencies) / len(latencies), 3)}s "
+                     f"median {round(latencies[len(latencies) // 2], 3)}s "
+                     f"p95 {round(latencies[int(len(latencies) * 0.95)], 3)}s "
+                     f"max {round(latencies[-1], 3)}s.")
+        for lexeme_id, error in failures:
+            text += f"\nFailed {lexeme_id}: {error}"
+        return text
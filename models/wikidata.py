@@ -1,14 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import json
 import logging
 from enum import Enum
-from typing import List
+from typing import List, Dict, Iterable, Set
 
-from wikibaseintegrator import wbi_core, wbi_datatype
-
-# This config sets the URL for the Wikibase and tool.
-from wikibaseintegrator.wbi_functions import execute_sparql_query
+import requests
+from wikibaseintegrator import wbi_config, wbi_core, wbi_datatype
+from wikibaseintegrator.wbi_exceptions import MWApiError
 
 import config
+from models.edit_scheduler import Throttled, throttled_from_response
+from models.http_client import HTTPClient, execute_sparql_query, shared_client
+from models.metrics import metrics
 from modules import wdqs
 
 
@@ -96,13 +100,18 @@ class ForeignID:
     no_value: bool
     property: str  # This is the property with type ExternalId
     source_item_id: str  # This is the Q-item for the source
+    # The models.source.DictionarySource of the id. It decides which
+    # lemmas get novalue and the edit summary, see dictionary_source()
+    source: object
 
     def __init__(self,
                  id: str = None,
                  property: str = None,
                  source_item_id: str = None,
-                 no_value: bool = False):
+                 no_value: bool = False,
+                 source=None):
         self.id = id
+        self.source = source
         if property is None:
             raise Exception("Property is mandatory.")
         self.property = EntityID(property).to_string()
@@ -110,36 +119,165 @@ class ForeignID:
             self.source_item_id = EntityID(source_item_id).to_string()
         self.no_value = no_value
 
+    def dictionary_source(self):
+        """The source of the id, by default the one of the property"""
+        if self.source is not None:
+            return self.source
+        # Imported here because models.source imports this module
+        from models.source import source_for_property
+        return source_for_property(self.property)
+
+
+def fetch_entities(ids: List[str], session: HTTPClient = None,
+                   max_retries: int = None, timeout: float = None) -> Dict[str, dict]:
+    """The current JSON of the entities from one wbgetentities request,
+    missing ones are left out. Raises Throttled like Lexeme.write() so
+    a fetch made for an edit is retried by models/edit_scheduler.py"""
+    try:
+        with metrics.request("wbgetentities"):
+            response = (session or shared_client()).get(
+                wbi_config.config["MEDIAWIKI_API_URL"],
+                params={"action": "wbgetentities", "ids": "|".join(ids),
+                        "maxlag": config.maxlag, "format": "json"},
+                max_retries=max_retries,
+                timeout=timeout
+            )
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise Throttled(f"Could not reach the API: {e}")
+    throttled = throttled_from_response(response)
+    if throttled is not None:
+        raise throttled
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        raise Exception(f"wbgetentities failed: {data['error']}")
+    return {id: entity for id, entity in data.get("entities", {}).items()
+            if "missing" not in entity}
+
+
 class Lexeme:
     id: str
     lemma: str
     lexical_category: str
+    # The properties of the dictionaries the lexeme has no statement
+    # with, None if not known
+    missing_properties: Set[str]
 
     def __init__(self,
                  id: str = None,
                  lemma: str = None,
-                 lexical_category: str = None):
+                 lexical_category: str = None,
+                 missing_properties: Set[str] = None):
         self.id = EntityID(id).to_string()
         self.lemma = lemma
         self.lexical_category = lexical_category
+        self.missing_properties = missing_properties
 
     def url(self):
         return f"{config.wd_prefix}{self.id}"
 
+    def needs_upload(self, foreign_id: ForeignID = None) -> bool:
+        """Return false if upload_foreign_id_to_wikidata() would skip
+        the foreign id without making an edit"""
+        if foreign_id is None:
+            raise Exception("Foreign id was None")
+        if foreign_id.no_value:
+            # Lemmas the dictionary does not cover yet are not missing from it
+            return foreign_id.dictionary_source().covers(self.lemma)
+        return True
+
+    def write(self,
+              item: wbi_core.ItemEngine = None,
+              edit_summary: str = None,
+              base_revision: int = None,
+              session: HTTPClient = None) -> dict:
+        """Send the new statements of the item in one wbeditentity request
+        like ItemEngine.write() does, but without its sleeping and retrying
+        so models/edit_scheduler.py is the only thing that waits. Raises
+        Throttled if the API asks us to slow down or cannot be reached and
+        MWApiError if it refuses the edit. Returns the JSON of the response
+
+        base_revision is the revision the edit is based on. If the lexeme
+        was edited since then the API merges the edit or refuses it with
+        an editconflict error"""
+        if item is None:
+            raise ValueError("Did not get the arguments needed")
+        if edit_summary is None:
+            edit_summary = f"Added foreign identifier with [[{config.tool_url}]]"
+        entity = item.get_json_representation()
+        # Statements that already have an id are unchanged
+        claims = {}
+        for property, statements in entity.get("claims", {}).items():
+            new_statements = [statement for statement in statements
+                              if "id" not in statement or "remove" in statement]
+            if new_statements:
+                claims[property] = new_statements
+        data = {key: value for key, value in entity.items() if key != "claims"}
+        data["claims"] = claims
+        login = config.login_instance
+        payload = {
+            "action": "wbeditentity",
+            "id": self.id,
+            "data": json.dumps(data),
+            "summary": edit_summary,
+            "token": login.get_edit_token(),
+            "maxlag": config.maxlag,
+            "bot": "",
+            "assert": "user",
+            "format": "json"
+        }
+        if base_revision is not None:
+            payload["baserevid"] = base_revision
+        login_session = login.get_session()
+        try:
+            with metrics.request("wikidata_write"):
+                response = (session or shared_client()).post(
+                    wbi_config.config["MEDIAWIKI_API_URL"],
+                    data=payload,
+                    cookies=login_session.cookies,
+                    auth=login_session.auth,
+                    # A throttled edit is retried by the scheduler
+                    max_retries=0
+                )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise Throttled(f"Could not reach the API: {e}")
+        throttled = throttled_from_response(response)
+        if throttled is not None:
+            raise throttled
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            raise MWApiError(result)
+        return result
+
     def upload_foreign_id_to_wikidata(self,
-                                      foreign_id: ForeignID = None):
-        """Upload to enrich the wonderfull Wikidata <3"""
+                                      foreign_id: ForeignID = None,
+                                      entity: dict = None,
+                                      session: HTTPClient = None):
+        """Upload to enrich the wonderfull Wikidata <3
+
+        entity is the current JSON of the lexeme if it was already
+        fetched, otherwise it is fetched with fetch_entities(). The edit is
+        based on its revision so a conflicting edit made since is detected.
+        WBI never fetches it. Raises Throttled like write()"""
         logger = logging.getLogger(__name__)
         if foreign_id is None:
             raise Exception("Foreign id was None")
-        elif foreign_id.no_value:
-            # We did not find the lemma in SAOB
-            # See https://www.saob.se/artikel/?pz=1&seek=%C3%A4rva
-            # Skip unsupported lemmas
-            supported_by_saob = "abcdefghijklmnopqrstu"
-            if self.lemma[:1] not in supported_by_saob:
-                logger.debug("Skip adding no-value to this lemma because "
-                             "SAOB only published lemma from a-u.")
+        if entity is None and (not foreign_id.no_value or self.needs_upload(foreign_id)):
+            # Fetched here instead of by WBI which sleeps and retries on
+            # its own, see fetch_entities()
+            entity = fetch_entities([self.id], session=session, max_retries=0).get(self.id)
+            if entity is None:
+                raise Exception(f"{self.id} was not found, it may have been deleted")
+        base_revision = entity.get("lastrevid") if entity is not None else None
+        source = foreign_id.dictionary_source()
+        edit_summary = source.edit_summary(foreign_id)
+        if foreign_id.no_value:
+            # We did not find the lemma in the dictionary
+            # Skip lemmas it does not cover
+            if not self.needs_upload(foreign_id):
+                logger.debug(f"Skip adding no-value to this lemma because "
+                             f"{source} does not cover it yet.")
             else:
                 print(f"Uploading no_value statement to {self.id}: {self.lemma}")
                 time_object = WikidataTimeFormat(datetime.today())
@@ -155,19 +293,19 @@ class Lexeme:
                 )
                 item = wbi_core.ItemEngine(
                     data=[statement],
-                    item_id=self.id
+                    item_id=self.id,
+                    item_data=entity
                 )
                 # debug WBI error
                 # print(item.get_json_representation())
-                result = item.write(
-                    config.login_instance,
-                    edit_summary=f"Added foreign identifier with [[{config.tool_url}]]"
-                )
-                logger.debug(f"result from WBI:{result}")
+                result = self.write(item, edit_summary=edit_summary,
+                                    base_revision=base_revision, session=session)
+                metrics.increment("no_value_uploads")
+                logger.debug(f"result from the API:{result}")
                 print(self.url())
                 #exit(0)
         else:
-            # We found the lemma in SAOB
+            # We found the lemma in the dictionary
             print(f"Uploading {foreign_id.id} to {self.id}: {self.lemma}")
             statement = wbi_datatype.ExternalID(
                 prop_nr=foreign_id.property,
@@ -181,15 +319,15 @@ class Lexeme:
             item = wbi_core.ItemEngine(
                 data=[statement,
                       described_by_source],
-                item_id=self.id
+                item_id=self.id,
+                item_data=entity
             )
             # debug WBI error
             # print(item.get_json_representation())
-            result = item.write(
-                config.login_instance,
-                edit_summary=f"Added foreign identifier with [[{config.tool_url}]]"
-            )
-            logger.debug(f"result from WBI:{result}")
+            result = self.write(item, edit_summary=edit_summary,
+                                base_revision=base_revision, session=session)
+            metrics.increment("id_uploads")
+            logger.debug(f"result from the API:{result}")
             print(self.url())
             # exit(0)
 
@@ -215,6 +353,7 @@ class LexemeLanguage:
     def __init__(self, language_code: str):
         self.language_code = WikimediaLanguageCode(language_code)
         self.language_qid = WikimediaLanguageQID[self.language_code.name]
+        self.lexemes = []
 
     def __str__(self):
         return (f"{self.language_code.name} has "
@@ -361,56 +500,156 @@ class LexemeLanguage:
     def calculate_senses_with_p5137_per_lexeme(self):
         self.senses_with_P5137_per_lexeme = round(self.senses_with_P5137 / self.lexemes_count, 3)
 
-    def fetch_all_lexemes_without_saob_id(self):
-        """download all swedish lexemes via sparql (~23000 as of 2021-04-05)"""
-        # dictionary with word as key and list in the value
-        # list[0] = lid
-        # list[1] = category Qid
-        print("Fetching all lexemes")
-        lexemes_data = {}
-        lexeme_lemma_list = []
-        for i in range(0, 30000, 10000):
-            print(i)
-            results = execute_sparql_query(f"""
-                    select ?lexemeId ?lemma ?category
-                WHERE {{
-                  #hint:Query hint:optimizer "None".
-                  ?lexemeId dct:language wd:Q9027;
+    def lexemes_without_properties_pattern(self, properties: List[str]):
+        """Graph pattern of the lexemes to fetch, those that have no
+        statement, not even a novalue one, with at least one of the
+        properties. With several properties ?hasP1234 tells whether the
+        lexeme has P1234."""
+        pattern = f"""
+                  ?lexemeId dct:language wd:{self.language_qid.value};
                             wikibase:lemma ?lemma;
-                            wikibase:lexicalCategory ?category.
+                            wikibase:lexicalCategory ?category."""
+        if len(properties) == 1:
+            return pattern + f"""
                   MINUS{{
-                    ?lexemeId wdt:P8478 [].
+                    ?lexemeId wdt:{properties[0]} [].
                   }}
                   MINUS {{
                     # Exclude truthy no value statements
-                    ?lexemeId a wdno:P8478.                  
-                  }}
-                }}
-        limit 10000
-        offset {i}
-            """)
-            if len(results) == 0:
-                print("No lexeme found")
-            else:
-                # print("adding lexemes to list")
-                # pprint(results.keys())
-                # pprint(results["results"].keys())
-                # pprint(len(results["results"]["bindings"]))
-                for result in results["results"]["bindings"]:
-                    # print(result)
-                    # *************************
-                    # Handle result and upload
-                    # *************************
-                    lemma = result["lemma"]["value"]
-                    lid = result["lexemeId"]["value"].replace(config.wd_prefix, "")
-                    lexical_category = result["category"]["value"].replace(config.wd_prefix, "")
-                    self.lexemes.append(Lexeme(
-                        id=lid,
-                        lemma=lemma,
-                        lexical_category=lexical_category
-                    ))
+                    ?lexemeId a wdno:{properties[0]}.
+                  }}"""
+        for property in properties:
+            pattern += f"""
+                  BIND(EXISTS {{ ?lexemeId wdt:{property} [] }} ||
+                       EXISTS {{ ?lexemeId a wdno:{property} }} AS ?has{property})"""
+        missing = " || ".join(f"!?has{property}" for property in properties)
+        return pattern + f"""
+                  FILTER({missing})"""
+
+    def count_lexemes_without_properties_per_category(self, properties: List[str]) -> Dict[str, int]:
+        """Returns the number of (lexeme, lemma) rows per lexical category"""
+        with metrics.request("sparql"):
+            results = execute_sparql_query(f"""
+                    select ?category (COUNT(*) as ?count)
+                    WHERE {{{self.lexemes_without_properties_pattern(properties)}
+                    }}
+                    GROUP BY ?category
+                """)
+        counts = {}
+        for result in results["results"]["bindings"]:
+            category = result["category"]["value"].replace(config.wd_prefix, "")
+            counts[category] = int(result["count"]["value"])
+        return counts
+
+    def fetch_lexemes_without_properties_in_category(self, category: str,
+                                                     properties: List[str]) -> List[Lexeme]:
+        """Page through one lexical category until it is exhausted.
+        The pages are ordered so they cannot overlap or miss rows."""
+        lexemes = []
+        offset = 0
+        flags = "".join(f" ?has{property}" for property in properties) if len(properties) > 1 else ""
+        while True:
+            with metrics.request("sparql"):
+                results = execute_sparql_query(f"""
+                        select ?lexemeId ?lemma ?category{flags}
+                    WHERE {{
+                      #hint:Query hint:optimizer "None".
+                      BIND(wd:{category} as ?category){self.lexemes_without_properties_pattern(properties)}
+                    }}
+            ORDER BY ?lexemeId ?lemma
+            limit {config.sparql_page_size}
+            offset {offset}
+                """)
+            bindings = results["results"]["bindings"]
+            for result in bindings:
+                lemma = result["lemma"]["value"]
+                lid = result["lexemeId"]["value"].replace(config.wd_prefix, "")
+                if len(properties) > 1:
+                    missing_properties = {property for property in properties
+                                          if result[f"has{property}"]["value"] != "true"}
+                else:
+                    missing_properties = set(properties)
+                lexemes.append(Lexeme(
+                    id=lid,
+                    lemma=lemma,
+                    lexical_category=category,
+                    missing_properties=missing_properties
+                ))
+            if len(bindings) < config.sparql_page_size:
+                return lexemes
+            offset += config.sparql_page_size
+
+    def fetch_all_lexemes_without_properties(self, properties: List[str]):
+        """download all lexemes in the language that lack at least one of
+        the properties via sparql (~23000 swedish lexemes without a SAOB id
+        as of 2021-04-05)
+
+        The lexemes are partitioned by lexical category and the partitions
+        are fetched in parallel. Every partition is checked against the
+        count of a COUNT query and refetched once if it differs."""
+        logger = logging.getLogger(__name__)
+        print("Fetching all lexemes")
+        counts = self.count_lexemes_without_properties_per_category(properties)
+        print(f"Fetching {sum(counts.values())} lexemes in {len(counts)} lexical categories")
+
+        def fetch(category: str) -> List[Lexeme]:
+            lexemes = self.fetch_lexemes_without_properties_in_category(category, properties)
+            if len(lexemes) != counts[category]:
+                logger.warning(f"Got {len(lexemes)} lexemes in {category} but "
+                               f"expected {counts[category]}, fetching again")
+                metrics.increment("sparql_refetches")
+                lexemes = self.fetch_lexemes_without_properties_in_category(category, properties)
+                if len(lexemes) != counts[category]:
+                    # Wikidata is edited while we fetch so this can happen
+                    logger.warning(f"Got {len(lexemes)} lexemes in {category} again "
+                                   f"but expected {counts[category]}")
+            return lexemes
+
+        self.lexemes = []
+        with ThreadPoolExecutor(max_workers=config.sparql_workers) as executor:
+            for lexemes in executor.map(fetch, sorted(counts)):
+                self.lexemes += lexemes
+        # Same order every run no matter which partition finished first
+        self.lexemes.sort(key=lambda lexeme: (EntityID(lexeme.id).number, lexeme.lemma))
+        metrics.increment("lexemes_fetched", len(self.lexemes))
         print(f"{len(self.lexemes)} fetched")
 
+    def fetch_glosses(self, lexeme_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """The glosses in the language of the senses of the lexemes
+        by lexeme id. Lexemes without any are left out."""
+        glosses = {}
+        lexeme_ids = list(dict.fromkeys(lexeme_ids))
+        # Small enough for a GET of the query
+        chunk_size = 200
+        for start in range(0, len(lexeme_ids), chunk_size):
+            values = " ".join(f"wd:{id}" for id in lexeme_ids[start:start + chunk_size])
+            with metrics.request("sparql"):
+                results = execute_sparql_query(f"""
+                        select ?lexemeId ?gloss
+                    WHERE {{
+                      VALUES ?lexemeId {{ {values} }}
+                      ?lexemeId ontolex:sense ?sense.
+                      ?sense skos:definition ?gloss.
+                      FILTER(LANG(?gloss) = "{self.language_code.value}")
+                    }}
+                """)
+            for result in results["results"]["bindings"]:
+                lid = result["lexemeId"]["value"].replace(config.wd_prefix, "")
+                glosses.setdefault(lid, []).append(result["gloss"]["value"])
+        return glosses
+
+    def fetch_all_lexemes_without_properties_from_dump(self, dump, properties: List[str]):
+        """Same as fetch_all_lexemes_without_properties() but read from
+        a local models.lexeme_dump.LexemeDump instead of WDQS"""
+        print(f"Reading all lexemes from {dump.path}")
+        self.lexemes = list(dump.lexemes_without_properties(
+            language_qid=self.language_qid.value,
+            properties=properties
+        ))
+        self.lexemes.sort(key=lambda lexeme: (EntityID(lexeme.id).number, lexeme.lemma))
+        metrics.increment("lexemes_fetched", len(self.lexemes))
+        print(f"{len(self.lexemes)} read")
+
     def lemma_list(self):
         lemmas = []
         for lexeme in self.lexemes: